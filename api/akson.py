@@ -2,12 +2,11 @@
 akson package contains the interface that needs to be implemented by assistants.
 """
 
-import os
 import uuid
 from abc import ABC, abstractmethod
-from typing import Callable, Coroutine, Literal, Optional
+from typing import Any, Callable, Coroutine, Literal, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, model_validator
 
 
 class ToolCall(BaseModel):
@@ -21,37 +20,59 @@ class Message(BaseModel):
     role: Literal["user", "assistant", "tool"]
     name: Optional[str] = None  # Name of the assistant
     content: str
-    tool_call: Optional[ToolCall] = None  # Only set if role is "assistant"
+    tool_calls: Optional[list[ToolCall]] = None  # Only set if role is "assistant"
     tool_call_id: Optional[str] = None  # Only set if role is "tool"
+    truncated: bool = False  # Set if the run was cancelled before the message was complete
+
+    @model_validator(mode="before")
+    @classmethod
+    def _upgrade_tool_call(cls, data: Any) -> Any:
+        # Messages saved before an assistant message could have several tool calls have a single `tool_call`.
+        if isinstance(data, dict) and "tool_call" in data:
+            data = dict(data)
+            tool_call = data.pop("tool_call")
+            if tool_call and "tool_calls" not in data:
+                data["tool_calls"] = [tool_call]
+        return data
 
 
 class ChatState(BaseModel):
-    """Chat that can be saved and loaded from a file."""
+    """Chat that can be saved and loaded by a storage backend. See `storage` module."""
 
     id: str = Field(default_factory=lambda: str(uuid.uuid4()).replace("-", ""))
     messages: list[Message] = []
     assistant: Optional[str] = None
     title: Optional[str] = None
 
+    # Message ids, assistant and title as of the last load or save. None if the state has never been persisted.
+    _persisted: Optional[tuple[list[str], Optional[str], Optional[str]]] = PrivateAttr(default=None)
+
     @classmethod
     def create_new(cls, id: str, assistant: str):
         return cls(id=id, assistant=assistant)
 
-    # TODO make this instance method
-    @classmethod
-    def load_from_disk(cls, chat_id: str):
-        with open(cls.file_path(chat_id), "r") as f:
-            content = f.read()
-            return cls.model_validate_json(content)
-
-    def save_to_disk(self):
-        os.makedirs("chats", exist_ok=True)
-        with open(self.file_path(self.id), "w") as f:
-            f.write(self.model_dump_json(indent=2))
+    def _mark_persisted(self):
+        self._persisted = ([message.id for message in self.messages], self.assistant, self.title)
 
-    @staticmethod
-    def file_path(id: str):
-        return os.path.join("chats", f"{id}.json")
+    def _get_changes(self) -> Optional[tuple[list[Message], dict[str, Any]]]:
+        """
+        Returns the messages appended and the fields updated since the state was last persisted.
+        Returns None if the state has never been persisted or if messages were removed or reordered.
+        """
+        if self._persisted is None:
+            return None
+        message_ids, assistant, title = self._persisted
+        if len(self.messages) < len(message_ids):
+            return None
+        if any(message.id != id for message, id in zip(self.messages, message_ids)):
+            return None
+
+        updates = {}
+        if self.assistant != assistant:
+            updates["assistant"] = self.assistant
+        if self.title != title:
+            updates["title"] = self.title
+        return self.messages[len(message_ids) :], updates
 
 
 class Reply:
@@ -68,6 +89,7 @@ class Reply:
     @classmethod
     async def create(cls, *args, **kwargs) -> "Reply":
         self = cls(*args, **kwargs)
+        self.chat._replies.append(self)
         await self.chat._queue_message(
             {
                 "type": "begin_message",
@@ -82,39 +104,56 @@ class Reply:
 
     FieldType = Literal["content", "tool_call.id", "tool_call.name", "tool_call.arguments", "tool_call_id"]
 
-    async def add_chunk(self, chunk: str, *, field: FieldType = "content"):
+    async def add_chunk(self, chunk: str, *, field: FieldType = "content", index: int = 0):
+        """Adds a chunk to a field of the message. `index` selects the tool call for `tool_call.*` fields."""
+        event: dict[str, Any] = {
+            "type": "add_chunk",
+            "id": self.message.id,
+            "field": field,
+            "chunk": chunk,
+        }
         if field == "content":
             self.message.content += chunk
         elif field == "tool_call_id":
             self.message.tool_call_id = chunk
         elif field.startswith("tool_call."):
-            if not self.message.tool_call:
-                self.message.tool_call = ToolCall(id="", name="", arguments="")
+            if self.message.tool_calls is None:
+                self.message.tool_calls = []
+            while len(self.message.tool_calls) <= index:
+                self.message.tool_calls.append(ToolCall(id="", name="", arguments=""))
+            tool_call = self.message.tool_calls[index]
             match field:
                 case "tool_call.id":
-                    self.message.tool_call.id = chunk
+                    tool_call.id = chunk
                 case "tool_call.name":
-                    self.message.tool_call.name += chunk
+                    tool_call.name += chunk
                 case "tool_call.arguments":
-                    self.message.tool_call.arguments += chunk
-        await self.chat._queue_message(
-            {
-                "type": "add_chunk",
-                "id": self.message.id,
-                "field": field,
-                "chunk": chunk,
-            }
-        )
+                    tool_call.arguments += chunk
+            event["index"] = index
+        await self.chat._queue_message(event)
 
-    async def end(self):
-        await self.chat._queue_message(
-            {
-                "type": "end_message",
-                "id": self.message.id,
-            }
-        )
+    async def end(self, *, truncated: bool = False):
+        """
+        Ends the message and adds it to the chat.
+        Pass `truncated` when the run is cancelled before the message is complete.
+        A truncated message without content is not added.
+        """
+        self.chat._replies.remove(self)
+        event: dict[str, Any] = {
+            "type": "end_message",
+            "id": self.message.id,
+        }
+        if truncated:
+            self.message.truncated = True
+            # Partial tool calls cannot be sent to the model again.
+            self.message.tool_calls = None
+            event["truncated"] = True
+        await self.chat._queue_message(event)
+        if truncated and not (self.message.content or self.message.tool_calls):
+            return
         self.chat.new_messages.append(self.message)
         self.chat.state.messages.append(self.message)
+        self.chat._save()
 
 
 class Chat:
@@ -129,6 +168,7 @@ class Chat:
         *,
         state: Optional[ChatState] = None,
         publisher: Optional[Callable[[dict], Coroutine]] = None,
+        saver: Optional[Callable[[ChatState], None]] = None,
     ):
         if not state:
             state = ChatState()
@@ -144,14 +184,34 @@ class Chat:
         # Publishes messages to clients.
         self.publisher = publisher
 
+        # Persists the state after each message is completed.
+        self.saver = saver
+
+        # Id of the run that is generating messages. Added to published messages.
+        self.run_id: Optional[str] = None
+
+        # Replies that have begun but not ended.
+        self._replies: list[Reply] = []
+
     async def reply(self, role: Literal["assistant", "tool"], name: str) -> Reply:
         # category: Optional[Literal["info", "success", "warning", "error"]] = None,
         return await Reply.create(chat=self, role=role, name=name)
 
+    async def truncate(self):
+        """Ends the replies in progress, keeping what they have so far. Called when the run is cancelled."""
+        for reply in list(self._replies):
+            await reply.end(truncated=True)
+
     async def _queue_message(self, message: dict):
+        if self.run_id:
+            message["run_id"] = self.run_id
         if self.publisher:
             await self.publisher(message)
 
+    def _save(self):
+        if self.saver:
+            self.saver(self.state)
+
 
 class Assistant(ABC):
     """Assistants are used to generate responses to chats."""
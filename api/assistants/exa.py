@@ -2,7 +2,7 @@ import os
 
 from exa_py import Exa as ExaClient
 
-from framework import Agent, FunctionToolkit
+from framework import Agent, FunctionToolkit, tool
 
 client = ExaClient(os.environ["EXA_API_KEY"])
 
@@ -13,6 +13,7 @@ system_prompt = """
 """
 
 
+@tool(cache_ttl=3600)
 def search(query: str) -> str:
     """
     The search endpoint lets you intelligently search the web and extract contents from the results.
@@ -30,6 +31,7 @@ def search(query: str) -> str:
     return str(results)
 
 
+@tool(cache_ttl=3600)
 def contents(urls: list[str]) -> str:
     """
     Get the full page contents, summaries, and metadata for a list of URLs.
@@ -47,6 +49,7 @@ def contents(urls: list[str]) -> str:
     return str(results)
 
 
+@tool(cache_ttl=3600)
 def find_similar(url: str) -> str:
     """
     Find similar links to the link provided and optionally return the contents of the pages.
@@ -62,6 +65,7 @@ def find_similar(url: str) -> str:
     return str(results)
 
 
+@tool(cache_ttl=3600)
 def answer(question: str) -> str:
     """
     Get an LLM answer to a question informed by Exa search results. Fully compatable with OpenAI’s chat completions endpoint - docs here.
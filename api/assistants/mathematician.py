@@ -1,4 +1,4 @@
-from framework import Agent, FunctionToolkit
+from framework import Agent, FunctionToolkit, tool
 
 system_prompt = """
     You are a mathematician but you can only add two numbers.
@@ -7,6 +7,8 @@ system_prompt = """
 """
 
 
+# Quick enough to run on the event loop
+@tool(execution="inline")
 def add_two_numbers(a: int, b: int) -> int:
     """
     Add two numbers
@@ -21,6 +23,7 @@ def add_two_numbers(a: int, b: int) -> int:
     return a + b
 
 
+@tool(execution="inline")
 def substract_two_numbers(a: int, b: int) -> int:
     """
     Subtract two numbers
@@ -4,7 +4,7 @@ import time
 import putiopy
 import httpx
 
-from framework import Agent, FunctionToolkit
+from framework import Agent, FunctionToolkit, tool
 
 PUTIO_TOKEN = os.environ["PUTIO_TOKEN"]
 
@@ -35,6 +35,8 @@ system_prompt = """
 """
 
 
+# Seeders change, so results are cached briefly.
+@tool(cache_ttl=600)
 async def search_movie(movie: str, year: int):
     """Search for a movie on the Internet.
     Returns a list of dictionaries, each dictionary contains title and link."""
@@ -48,6 +50,7 @@ async def search_movie(movie: str, year: int):
         return [{"title": r["Title"], "link": r["MagnetUri"]} for r in results]
 
 
+@tool(side_effects=True)
 def download_movie(url):
     """Download a movie from the Internet.
     Returns a dictionary containing the video link."""
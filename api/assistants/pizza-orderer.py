@@ -6,5 +6,6 @@ pizza_orderer = Agent(
     toolkit=MCPToolkit(
         command="uv",
         args=["run", "python", "mcp-servers/bland.py"],
+        side_effects=["make_call"],
     ),
 )
@@ -2,7 +2,7 @@ from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
-from framework import Agent, FunctionToolkit
+from framework import Agent, FunctionToolkit, tool
 
 
 class TemporalContext(BaseModel):
@@ -211,6 +211,7 @@ system_prompt = """
 """
 
 
+@tool(side_effects=True)
 def save_info(info: SaveInfo):
     print("Saving info...")
     with open("life_history.jsonl", "a") as f:
@@ -3,7 +3,7 @@ import pathlib
 
 import httpx
 
-from framework import Agent, FunctionToolkit
+from framework import Agent, FunctionToolkit, tool
 
 PERPLEXITY_API_KEY = os.environ["PERPLEXITY_API_KEY"]
 
@@ -27,6 +27,7 @@ system_prompt = f"""
 """
 
 
+@tool(cache_ttl=3600)
 async def search_web(query: str) -> str:
     """
     Use this function to search the web.
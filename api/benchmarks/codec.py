@@ -0,0 +1,73 @@
+"""
+Compares the previous JSON handling of chat states with the codec module for a 10k-message chat.
+
+Run from the api directory:
+
+    python -m benchmarks.codec
+"""
+
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+import codec
+from akson import ChatState, Message, ToolCall
+
+MESSAGES = 10_000
+ROUNDS = 5
+
+
+def make_state() -> ChatState:
+    messages = []
+    for i in range(MESSAGES):
+        tool_calls = None
+        if i % 3 == 0:
+            tool_calls = [ToolCall(id=f"call_{i}", name="search", arguments='{"query": "weather in Istanbul"}')]
+        messages.append(
+            Message(
+                role="assistant" if i % 2 else "user",
+                name="ChatGPT" if i % 2 else None,
+                content="The quick brown fox jumps over the lazy dog. " * 10,
+                tool_calls=tool_calls,
+            )
+        )
+    return ChatState(id="benchmark", assistant="ChatGPT", title="Benchmark", messages=messages)
+
+
+def measure(name: str, func) -> float:
+    func()  # Warm up
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        func()
+    elapsed = (time.perf_counter() - start) / ROUNDS * 1000
+    print(f"  {name:<10} {elapsed:8.1f} ms")
+    return elapsed
+
+
+def main():
+    state = make_state()
+    pretty = state.model_dump_json(indent=2)
+    compact = codec.encode_state(state)
+    print(f"{MESSAGES} messages, orjson {'enabled' if codec.orjson else 'disabled'}")
+    print(f"size: {len(pretty.encode()) / 1e6:.1f} MB indented, {len(compact) / 1e6:.1f} MB compact")
+
+    print("save")
+    before = measure("before", lambda: state.model_dump_json(indent=2))
+    after = measure("after", lambda: codec.encode_state(state))
+    print(f"  speedup    {before / after:8.1f}x")
+
+    print("load")
+    before = measure("before", lambda: ChatState.model_validate_json(pretty))
+    after = measure("after", lambda: codec.decode_state(compact))
+    print(f"  speedup    {before / after:8.1f}x")
+
+    # FastAPI converts the returned model to plain data before encoding it when response_model is used.
+    print("response encode")
+    before = measure("before", lambda: json.dumps(jsonable_encoder(state)).encode())
+    after = measure("after", lambda: codec.encode_state(state))
+    print(f"  speedup    {before / after:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
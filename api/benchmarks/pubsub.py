@@ -0,0 +1,71 @@
+"""
+Measures PubSub.publish fan-out to 1, 10 and 1000 subscribers,
+compared to the previous approach of creating a task per subscriber for each message.
+
+Run from the api directory:
+
+    python -m benchmarks.pubsub
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+
+from logger import logger
+from pubsub import Event, PubSub, Subscription
+
+EVENTS = 100_000
+SUBSCRIBERS = [1, 10, 1000]
+
+# The previous approach is much slower, so it publishes fewer events and the result is scaled.
+LEGACY_EVENTS = 1_000
+
+MESSAGE = {"type": "add_chunk", "id": "message", "field": "content", "chunk": "token"}
+
+
+async def measure_pubsub(subscribers: int, events: int) -> float:
+    pubsub = PubSub(max_queue_size=100, overflow="drop_oldest")
+    async with contextlib.AsyncExitStack() as stack:
+        for _ in range(subscribers):
+            await stack.enter_async_context(pubsub.subscribe("topic"))
+        start = time.perf_counter()
+        for _ in range(events):
+            await pubsub.publish("topic", MESSAGE)
+        return time.perf_counter() - start
+
+
+async def measure_legacy(subscribers: int, events: int) -> float:
+    queues = [Subscription(max_size=100, overflow="drop_oldest") for _ in range(subscribers)]
+    callbacks = []
+    for queue in queues:
+
+        async def callback(message, queue=queue):
+            queue.put(Event(message))
+
+        callbacks.append(callback)
+
+    start = time.perf_counter()
+    for _ in range(events):
+        tasks = [asyncio.create_task(callback(MESSAGE)) for callback in callbacks]
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return time.perf_counter() - start
+
+
+async def main():
+    # Subscribers in this benchmark never read, so every one of them reports dropped messages.
+    logger.setLevel(logging.ERROR)
+    print(f"{'subscribers':>11} {'events':>8} {'total':>9} {'per event':>11} {'legacy per event':>17} {'speedup':>8}")
+    for subscribers in SUBSCRIBERS:
+        elapsed = await measure_pubsub(subscribers, EVENTS)
+        legacy_events = max(1, LEGACY_EVENTS // subscribers)
+        legacy = await measure_legacy(subscribers, legacy_events) / legacy_events
+        per_event = elapsed / EVENTS
+        print(
+            f"{subscribers:>11} {EVENTS:>8} {elapsed:>8.2f}s {per_event * 1e6:>9.2f}us "
+            f"{legacy * 1e6:>15.2f}us {legacy / per_event:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
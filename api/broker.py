@@ -0,0 +1,230 @@
+"""
+Brokers pass published messages between processes,
+so clients connected to one worker receive the events of chats handled by another.
+"""
+
+import asyncio
+import fcntl
+import os
+import struct
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Optional
+
+import codec
+from logger import logger
+
+# Called with the topic and message of each message published by another process
+Deliver = Callable[[str, Any], Awaitable[Any]]
+
+
+class Broker(ABC):
+    """Sends messages published in this process to other processes and receives theirs."""
+
+    @abstractmethod
+    async def start(self, deliver: Deliver, resync: Callable[[], None]) -> None:
+        """
+        Starts passing messages.
+
+        Args:
+            deliver: Called with each message published by another process
+            resync: Called when messages from other processes might have been lost, e.g. after reconnecting
+        """
+        ...
+
+    @abstractmethod
+    def publish(self, topic: str, message: Any) -> None:
+        """Sends the message to other processes. Does not wait; messages may be sent in batches."""
+        ...
+
+    @abstractmethod
+    async def close(self) -> None: ...
+
+
+# Length of the batch that follows
+_HEADER = struct.Struct("!I")
+
+
+class UnixSocketBroker(Broker):
+    """
+    Connects the processes on a host through a Unix domain socket.
+
+    The process that holds a lock on `<path>.lock` is the hub. It listens on the socket
+    and relays batches between the other processes, which connect to it with one connection each.
+    If the hub exits, the lock is released and one of the other processes becomes the hub.
+
+    Messages published in the same iteration of the event loop are sent as one batch,
+    a length-prefixed JSON list of [topic, message] pairs. The hub forwards batches without decoding them.
+    """
+
+    # Messages kept while not connected to the hub
+    max_pending = 10_000
+    # Peers with more unsent data than this are disconnected, so a stuck process cannot exhaust memory
+    max_buffer = 16 * 1024 * 1024
+    # Seconds between attempts to connect to or become the hub
+    retry_interval = 0.5
+
+    def __init__(self, path: str):
+        self.path = path
+        self._deliver: Optional[Deliver] = None
+        self._resync: Optional[Callable[[], None]] = None
+        self._pending: list[tuple[str, Any]] = []
+        self._flush_scheduled = False
+        self._task: Optional[asyncio.Task] = None
+        # Set while this process is the hub
+        self._lock_file: Optional[int] = None
+        self._peers: set[asyncio.StreamWriter] = set()
+        # Set while connected to the hub
+        self._hub: Optional[asyncio.StreamWriter] = None
+
+    @property
+    def is_hub(self) -> bool:
+        return self._lock_file is not None
+
+    async def start(self, deliver: Deliver, resync: Callable[[], None]) -> None:
+        self._deliver = deliver
+        self._resync = resync
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._task = asyncio.create_task(self._run())
+
+    def publish(self, topic: str, message: Any) -> None:
+        self._pending.append((topic, message))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if not self._pending:
+            return
+        if self.is_hub and not self._peers:
+            self._pending.clear()
+            return
+        if not self.is_hub and not self._hub:
+            if len(self._pending) > self.max_pending:
+                logger.warning(
+                    "Not connected to event broker, dropping %d messages", len(self._pending) - self.max_pending
+                )
+                del self._pending[: -self.max_pending]
+            return
+        batch, self._pending = self._pending, []
+        data = codec.dumps(batch)
+        frame = _HEADER.pack(len(data)) + data
+        if self.is_hub:
+            for peer in list(self._peers):
+                self._send(peer, frame)
+        else:
+            self._send(self._hub, frame)  # type: ignore
+
+    def _send(self, writer: asyncio.StreamWriter, frame: bytes):
+        if writer.transport.get_write_buffer_size() > self.max_buffer:
+            logger.warning("Event broker peer is not reading, disconnecting it")
+            writer.close()
+            return
+        writer.write(frame)
+
+    async def _run(self):
+        connected_before = False
+        while True:
+            try:
+                if self._try_lock():
+                    if connected_before:
+                        # Messages published by others while the previous hub was going away are lost.
+                        self._resync()  # type: ignore
+                    connected_before = True
+                    await self._serve()
+                else:
+                    reader, self._hub = await asyncio.open_unix_connection(self.path)
+                    try:
+                        logger.info("Connected to event broker at %s", self.path)
+                        if connected_before:
+                            # Messages published by others while disconnected are lost.
+                            self._resync()  # type: ignore
+                        connected_before = True
+                        self._flush()
+                        await self._receive(reader)
+                    finally:
+                        self._hub.close()
+                        self._hub = None
+            except (OSError, asyncio.IncompleteReadError) as e:
+                # The hub is not up yet or has exited.
+                logger.debug("Event broker: %s", e)
+            finally:
+                self._unlock()
+            await asyncio.sleep(self.retry_interval)
+
+    def _try_lock(self) -> bool:
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_file = fd
+        return True
+
+    def _unlock(self):
+        if self._lock_file is None:
+            return
+        for peer in self._peers:
+            peer.close()
+        self._peers.clear()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.close(self._lock_file)
+        self._lock_file = None
+
+    async def _serve(self):
+        # Only the lock holder binds, so an existing socket file was left by a hub that exited.
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = await asyncio.start_unix_server(self._handle_peer, self.path)
+        logger.info("Serving event broker at %s", self.path)
+        try:
+            self._flush()
+            # Serve until cancelled. Server.serve_forever would wait for the peers to disconnect when cancelled.
+            await asyncio.Future()
+        finally:
+            server.close()
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        try:
+            await self._receive(reader, forward_from=writer)
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    async def _receive(self, reader: asyncio.StreamReader, forward_from: Optional[asyncio.StreamWriter] = None):
+        """Delivers received batches. The hub also forwards them to the other peers."""
+        while True:
+            header = await reader.readexactly(_HEADER.size)
+            data = await reader.readexactly(_HEADER.unpack(header)[0])
+            if forward_from:
+                frame = header + data
+                for peer in list(self._peers):
+                    if peer is not forward_from:
+                        self._send(peer, frame)
+            for topic, message in codec.loads(data):
+                await self._deliver(topic, message)  # type: ignore
+
+
+def create_broker(url: str) -> Optional[Broker]:
+    """
+    Creates a broker from a URL such as "unix:chats/events.sock".
+    Returns None for an empty URL, which keeps messages in the process.
+    """
+    scheme, _, address = url.partition(":")
+    match scheme:
+        case "":
+            return None
+        case "unix":
+            return UnixSocketBroker(address)
+        case _:
+            raise ValueError(f"Unknown event broker: {url}")
@@ -0,0 +1,206 @@
+import asyncio
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import models
+from akson import ChatState
+from logger import logger
+from storage import ChatStorage
+
+
+class CachedStorage(ChatStorage):
+    """
+    Keeps recently used chat states in memory and saves them to the underlying storage in the background.
+
+    Loading a cached chat returns the same ChatState object to every caller.
+    Saving only marks the chat as dirty. Dirty chats are written by `run_flusher`,
+    so many saves of an active chat are coalesced into one write.
+    The least recently used chats are evicted when the estimated size of the cached chats exceeds `max_size`,
+    dirty chats only after they are written.
+
+    Every change to a cached chat or to the list of chats gets a new version number, which is used for ETags.
+    Version numbers are never reused in a process, even after a chat is evicted and loaded again.
+
+    With `shared`, other processes write to the same storage, so a cached state could be stale
+    and flushing it would overwrite their changes. Chats are then loaded from and saved to the storage directly,
+    and there are no versions.
+    """
+
+    def __init__(
+        self,
+        storage: ChatStorage,
+        *,
+        max_size: int = 64 * 1024 * 1024,
+        flush_interval: float = 1.0,
+        shared: bool = False,
+    ):
+        self.storage = storage
+        self.shared = shared
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._states: OrderedDict[str, ChatState] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._size = 0
+        self._dirty: set[str] = set()
+        self._version_counter = itertools.count(1)
+        self._versions: dict[str, int] = {}
+        self._list_version = next(self._version_counter)
+        # Dependencies may load chats from worker threads.
+        self._lock = threading.RLock()
+        # Held while writing to the underlying storage, so writes of a chat are not reordered.
+        # Never acquired while holding `_lock`.
+        self._write_lock = threading.Lock()
+
+    def load(self, chat_id: str) -> Optional[ChatState]:
+        if self.shared:
+            return self.storage.load(chat_id)
+
+        with self._lock:
+            state = self._states.get(chat_id)
+            if state:
+                self._states.move_to_end(chat_id)
+                return state
+
+        state = self.storage.load(chat_id)
+        if not state:
+            return None
+
+        with self._lock:
+            # Another thread might have loaded the chat in the meantime.
+            if chat_id in self._states:
+                return self._states[chat_id]
+            self._put(state)
+            return state
+
+    def save(self, state: ChatState) -> None:
+        if self.shared:
+            self.storage.save(state)
+            return
+
+        with self._lock:
+            if self._states.get(state.id) is not state:
+                self._put(state)
+            self._dirty.add(state.id)
+            self._bump(state.id)
+
+    def delete(self, chat_id: str) -> None:
+        with self._write_lock:
+            with self._lock:
+                self._remove(chat_id)
+                self._list_version = next(self._version_counter)
+            self.storage.delete(chat_id)
+
+    def delete_message(self, chat_id: str, message_id: str) -> None:
+        with self._write_lock:
+            self._write([chat_id])
+            self.storage.delete_message(chat_id, message_id)
+            with self._lock:
+                state = self._states.get(chat_id)
+                if state:
+                    state.messages = [msg for msg in state.messages if msg.id != message_id]
+                    state._mark_persisted()
+                    self._bump(chat_id)
+                else:
+                    self._list_version = next(self._version_counter)
+
+    def list_chats(self, limit: Optional[int] = None, before: Optional[str] = None) -> list[models.ChatSummary]:
+        # Write pending changes first so the index reflects them.
+        self.flush()
+        return self.storage.list_chats(limit=limit, before=before)
+
+    def version(self, chat_id: str) -> Optional[int]:
+        """Returns the version of the chat or None if the chat is not cached."""
+        with self._lock:
+            return self._versions.get(chat_id)
+
+    def list_version(self) -> Optional[int]:
+        """Returns the version of the list of chats or None if the storage is shared."""
+        if self.shared:
+            return None
+        return self._list_version
+
+    def flush(self) -> None:
+        """Writes all dirty chats to the underlying storage. Blocks, so run it in a thread from the event loop."""
+        with self._write_lock:
+            with self._lock:
+                chat_ids = list(self._dirty)
+            self._write(chat_ids)
+            with self._lock:
+                self._evict()
+
+    async def run_flusher(self) -> None:
+        """Flushes dirty chats periodically. Runs until cancelled."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Error flushing chats: {e}")
+
+    def _write(self, chat_ids: list[str]):
+        """
+        Writes the chats if they are dirty. Must be called with `_write_lock` held.
+        Copies of the states are taken under `_lock` and written outside it, so loads and saves are not blocked.
+        """
+        for chat_id in chat_ids:
+            with self._lock:
+                if chat_id not in self._dirty:
+                    continue
+                state = self._states[chat_id]
+                # Messages are not changed after they are added, so copying the list is enough.
+                snapshot = state.model_copy(update={"messages": list(state.messages)})
+                self._dirty.discard(chat_id)
+            try:
+                self.storage.save(snapshot)
+            except BaseException:
+                with self._lock:
+                    if self._states.get(chat_id) is state:
+                        self._dirty.add(chat_id)
+                raise
+            with self._lock:
+                state._persisted = snapshot._persisted
+                if self._states.get(chat_id) is state:
+                    size = self._estimate_size(snapshot)
+                    self._size += size - self._sizes[chat_id]
+                    self._sizes[chat_id] = size
+
+    def _bump(self, chat_id: str):
+        self._versions[chat_id] = next(self._version_counter)
+        self._list_version = next(self._version_counter)
+
+    def _put(self, state: ChatState):
+        self._remove(state.id)
+        self._states[state.id] = state
+        self._sizes[state.id] = self._estimate_size(state)
+        self._size += self._sizes[state.id]
+        self._versions[state.id] = next(self._version_counter)
+        self._evict()
+
+    def _remove(self, chat_id: str):
+        if chat_id in self._states:
+            del self._states[chat_id]
+            self._size -= self._sizes.pop(chat_id)
+            self._dirty.discard(chat_id)
+            self._versions.pop(chat_id, None)
+
+    def _evict(self):
+        # Always keep the most recently used chat.
+        # Dirty chats are kept until they are written, see `flush`.
+        for chat_id in list(self._states)[:-1]:
+            if self._size <= self.max_size:
+                break
+            if chat_id not in self._dirty:
+                self._remove(chat_id)
+
+    @staticmethod
+    def _estimate_size(state: ChatState) -> int:
+        """Returns the approximate memory used by the state in bytes."""
+        size = 0
+        for message in state.messages:
+            # Fixed cost covers the object itself, id, role and name.
+            size += 500 + len(message.content)
+            for tool_call in message.tool_calls or []:
+                size += len(tool_call.arguments)
+        return size
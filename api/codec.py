@@ -0,0 +1,48 @@
+"""
+JSON encoding of chat states and events.
+
+Models are encoded with pydantic's compiled serializer into compact JSON bytes,
+which is faster than going through dicts with any JSON library.
+Plain data such as events and log records is encoded with orjson if it is installed (`pip install orjson`),
+otherwise with the standard library.
+Decoding accepts both compact and indented JSON, so files written by older versions remain readable.
+"""
+
+import json
+from typing import Any
+
+from akson import ChatState, Message
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """Encodes plain data as compact JSON."""
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def loads(data: bytes | str) -> Any:
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode_state(state: ChatState) -> bytes:
+    return state.__pydantic_serializer__.to_json(state)
+
+
+def decode_state(data: bytes | str) -> ChatState:
+    return ChatState.model_validate_json(data)
+
+
+def encode_message(message: Message) -> bytes:
+    return message.__pydantic_serializer__.to_json(message, exclude_none=True)
+
+
+def decode_message(data: bytes | str) -> Message:
+    return Message.model_validate_json(data)
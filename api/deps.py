@@ -1,38 +1,102 @@
 import os
+from typing import AsyncIterator
 
 from fastapi import Depends
 
 import models
 from akson import Assistant, Chat, ChatState
-from pubsub import PubSub
+from broker import create_broker
+from cache import CachedStorage
+from lanes import ChatLanes
+from pubsub import OverflowPolicy, PubSub
 from registry import Registry
+from runs import RunScheduler
+from storage import ChatStorage, create_storage
 
 # Load environment variables
 default_assistant = os.getenv("DEFAULT_ASSISTANT", "ChatGPT")
+chat_storage = os.getenv("CHAT_STORAGE", "file")
+chat_cache_size = int(os.getenv("CHAT_CACHE_SIZE", 64 * 1024 * 1024))
+chat_flush_interval = float(os.getenv("CHAT_FLUSH_INTERVAL", 1.0))
+event_queue_size = int(os.getenv("EVENT_QUEUE_SIZE", 1000))
+event_overflow: OverflowPolicy = os.getenv("EVENT_OVERFLOW", "coalesce")  # type: ignore
+event_window_ms = int(os.getenv("EVENT_WINDOW_MS", 50))
+event_window_size = int(os.getenv("EVENT_WINDOW_SIZE", 4096))
+event_replay_size = int(os.getenv("EVENT_REPLAY_SIZE", 500))
+event_replay_chats = int(os.getenv("EVENT_REPLAY_CHATS", 100))
+event_broker = os.getenv("EVENT_BROKER", "")
+run_concurrency = int(os.getenv("RUN_CONCURRENCY", 16))
 
 # Manages assistants
 registry = Registry()
 
 # For sending chat events to clients
-pubsub = PubSub()
+pubsub = PubSub(
+    max_queue_size=event_queue_size,
+    overflow=event_overflow,
+    window=event_window_ms / 1000,
+    window_size=event_window_size,
+    replay_size=event_replay_size,
+    replay_topics=event_replay_chats,
+    broker=create_broker(event_broker),
+)
 
-# Ensure chats directory exists
-os.makedirs("chats", exist_ok=True)
+if event_broker and chat_storage == "file":
+    # Workers could not tell how long the log of a chat is when another worker appends to it.
+    raise ValueError("EVENT_BROKER requires CHAT_STORAGE=sqlite")
+
+# Persists chat states, keeping active chats in memory.
+# With a broker, other workers write to the same storage, so chats are not cached.
+storage = CachedStorage(
+    create_storage(chat_storage),
+    max_size=chat_cache_size,
+    flush_interval=chat_flush_interval,
+    shared=bool(event_broker),
+)
+
+
+# Serializes changes to each chat, across workers if there is a broker
+lanes = ChatLanes(lock_dir=os.path.join("chats", "locks") if event_broker else None)
+
+# Limits the number of assistants running at once and tracks their status
+runs = RunScheduler(run_concurrency)
 
 
 def get_pubsub() -> PubSub:
     return pubsub
 
 
+def get_lanes() -> ChatLanes:
+    return lanes
+
+
+async def lock_chat(chat_id: str) -> AsyncIterator[None]:
+    """Holds the chat's lane during the request. Must be listed before dependencies that load the chat."""
+    async with lanes.acquire(chat_id):
+        yield
+
+
+def get_runs() -> RunScheduler:
+    return runs
+
+
+def get_storage() -> CachedStorage:
+    return storage
+
+
 def get_chat_state(chat_id: str) -> ChatState:
-    try:
-        return ChatState.load_from_disk(chat_id)
-    except FileNotFoundError:
-        return ChatState.create_new(chat_id, default_assistant)
+    state = storage.load(chat_id)
+    if not state:
+        state = ChatState.create_new(chat_id, default_assistant)
+    return state
 
 
 def get_chat(chat_id: str) -> Chat:
-    return Chat(state=get_chat_state(chat_id), publisher=pubsub.get_publisher(chat_id))
+    return Chat(
+        state=get_chat_state(chat_id),
+        publisher=pubsub.get_publisher(chat_id),
+        saver=storage.save,
+    )
 
 
 def get_assistant(message: models.SendMessageRequest, chat: Chat = Depends(get_chat)) -> Assistant:
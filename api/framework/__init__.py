@@ -3,6 +3,6 @@ framework package contains utilities for building assistants.
 """
 
 from .agent import Agent
-from .function_calling import FunctionToolkit, MCPToolkit, Toolkit
+from .function_calling import FunctionToolkit, MCPToolkit, Toolkit, tool
 
-__all__ = ["Agent", "Toolkit", "FunctionToolkit", "MCPToolkit"]
+__all__ = ["Agent", "Toolkit", "FunctionToolkit", "MCPToolkit", "tool"]
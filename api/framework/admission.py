@@ -0,0 +1,131 @@
+"""
+Limits how many completions run at once for each model and provider,
+so bursts wait in a queue instead of hitting the provider's rate limits.
+"""
+
+import asyncio
+import contextlib
+from collections import deque
+from typing import AsyncIterator, Literal
+
+from litellm.litellm_core_utils.get_llm_provider_logic import get_llm_provider
+
+# Interactive completions are admitted before background ones, such as titling.
+Priority = Literal["interactive", "background"]
+
+
+class QueueFull(Exception):
+    """Raised when too many completions are waiting for the same model or provider."""
+
+    def __init__(self, key: str, retry_after: int):
+        super().__init__(f"Too many requests for {key}, try again in {retry_after} seconds")
+        self.key = key
+        self.retry_after = retry_after
+
+
+class Limiter:
+    """
+    Admits at most `concurrency` holders at once. Others wait, interactive ones first, then in the order they arrived.
+    At most `max_queue` may wait; more raise QueueFull.
+    """
+
+    def __init__(self, key: str, concurrency: int, max_queue: int, retry_after: int):
+        self.key = key
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.active = 0
+        self.rejected = 0
+        self._waiters: dict[Priority, deque[asyncio.Future]] = {"interactive": deque(), "background": deque()}
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    async def acquire(self, priority: Priority) -> None:
+        if self.active < self.concurrency and not self.waiting:
+            self.active += 1
+            return
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull(self.key, self.retry_after)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just before cancelling.
+                self.release()
+            elif waiter in self._waiters[priority]:
+                self._waiters[priority].remove(waiter)
+            raise
+
+    def release(self) -> None:
+        # The slot is handed over to the next waiter, so newcomers cannot take it first.
+        for waiters in self._waiters.values():
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self.active -= 1
+
+    def stats(self) -> dict[str, int]:
+        return {"active": self.active, "waiting": self.waiting, "rejected": self.rejected}
+
+
+class AdmissionController:
+    """Holds a Limiter for each model and each provider. Completions need a slot of both."""
+
+    def __init__(self, *, model_concurrency: int, provider_concurrency: int, max_queue: int, retry_after: int):
+        self.model_concurrency = model_concurrency
+        self.provider_concurrency = provider_concurrency
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._models: dict[str, Limiter] = {}
+        self._providers: dict[str, Limiter] = {}
+        # Provider of each model, looked up once because litellm prints an error for unknown models
+        self._model_providers: dict[str, str] = {}
+
+    @contextlib.asynccontextmanager
+    async def admit(self, model: str, priority: Priority = "interactive") -> AsyncIterator[None]:
+        """
+        Waits until a completion with the model may run and holds its slots until the context exits.
+        Raises QueueFull if too many completions are waiting already.
+        """
+        limiters = [self._limiter(self._models, model, self.model_concurrency)]
+        provider = self._model_providers.get(model)
+        if not provider:
+            provider = self._model_providers[model] = _get_provider(model)
+        limiters.append(self._limiter(self._providers, provider, self.provider_concurrency))
+        # Always acquired in the same order, model first, so waiters cannot block each other.
+        acquired: list[Limiter] = []
+        try:
+            for limiter in limiters:
+                await limiter.acquire(priority)
+                acquired.append(limiter)
+            yield
+        finally:
+            for limiter in reversed(acquired):
+                limiter.release()
+
+    def stats(self) -> dict[str, dict[str, dict[str, int]]]:
+        """Returns counters for monitoring."""
+        return {
+            "models": {key: limiter.stats() for key, limiter in self._models.items()},
+            "providers": {key: limiter.stats() for key, limiter in self._providers.items()},
+        }
+
+    def _limiter(self, limiters: dict[str, Limiter], key: str, concurrency: int) -> Limiter:
+        limiter = limiters.get(key)
+        if not limiter:
+            limiter = limiters[key] = Limiter(key, concurrency, self.max_queue, self.retry_after)
+        return limiter
+
+
+def _get_provider(model: str) -> str:
+    try:
+        return get_llm_provider(model)[1]
+    except Exception:
+        return model.split("/")[0]
@@ -1,3 +1,5 @@
+import asyncio
+import inspect
 import os
 import re
 import time
@@ -17,11 +19,20 @@ from pydantic import BaseModel
 from akson import Assistant, Chat, Message, ToolCall
 from logger import logger
 
+from .admission import AdmissionController, Priority
 from .function_calling import Toolkit
 from .streaming import MessageBuilder
 
 DEFAULT_MODEL = os.environ["DEFAULT_MODEL"]
 
+# Limits concurrent completions. Shared by all agents in the process.
+admission = AdmissionController(
+    model_concurrency=int(os.getenv("LLM_MODEL_CONCURRENCY", 8)),
+    provider_concurrency=int(os.getenv("LLM_PROVIDER_CONCURRENCY", 16)),
+    max_queue=int(os.getenv("LLM_QUEUE_SIZE", 32)),
+    retry_after=int(os.getenv("LLM_RETRY_AFTER", 5)),
+)
+
 litellm.drop_params = True
 if os.getenv("LANGFUSE_PUBLIC_KEY") and os.getenv("LANGFUSE_SECRET_KEY"):
     litellm.success_callback = ["langfuse"]
@@ -40,9 +51,11 @@ class Agent(Assistant):
         output_type: Optional[type[BaseModel]] = None,
         toolkit: Optional[Toolkit] = None,
         max_turns: int = 10,
+        priority: Priority = "interactive",
     ):
         """
         Creates a new Agent.
+        Agents that do background work, such as titling chats, should pass `priority="background"`.
         """
         self.name = name
         self.description = description
@@ -51,6 +64,7 @@ class Agent(Assistant):
         self.output_type = output_type
         self.toolkit = toolkit
         self.max_turns = max_turns
+        self.priority: Priority = priority
         self.examples: list[tuple[str, BaseModel]] = []
 
     async def run(self, chat: Chat) -> None:
@@ -62,7 +76,16 @@ class Agent(Assistant):
         async def handle_tool_calls(message: LitellmMessage):
             assert self.toolkit
             assert message.tool_calls
-            tool_messages = await self.toolkit.handle_tool_calls(message.tool_calls)
+            try:
+                tool_messages = await self.toolkit.handle_tool_calls(message.tool_calls)
+            except asyncio.CancelledError:
+                # The model expects a result for every tool call in the history.
+                for tool_call in message.tool_calls:
+                    reply = await chat.reply("tool", name=self.name)
+                    await reply.add_chunk("Cancelled")
+                    await reply.add_chunk(tool_call.id, field="tool_call_id")
+                    await reply.end(truncated=True)
+                raise
             for tool_message in tool_messages:
                 assert tool_message.content
                 messages.append(tool_message)
@@ -104,54 +127,81 @@ class Agent(Assistant):
             if tools:
                 kwargs["tools"] = tools
                 kwargs["tool_choice"] = "auto"
-                kwargs["parallel_tool_calls"] = False
 
         if self.output_type:
             kwargs["response_format"] = self.output_type
 
-        response = await acompletion(
-            model=self.model,
-            messages=messages,
-            stream=True,
-            metadata={
-                "existing_trace_id": langfuse_context.get_current_trace_id(),
-                "parent_observation_id": langfuse_context.get_current_observation_id(),
-            },
-            **kwargs,
-        )
-        assert isinstance(response, CustomStreamWrapper)
-
-        # We start by sending a begin_message event to the web client.
-        # This will cause the web client to draw a new message box for the assistant.
-        reply = await chat.reply("assistant", name=self.name)
-
-        # We will aggregate delta messages and store them in this variable until we see a finish_reason.
-        # This is the only way to get the full content of the message.
-        # We'll return this value at the end of the function.
-        builder = MessageBuilder()
-
-        # We will return this value at the end of the function.
-        message: Optional[LitellmMessage] = None
-
-        # Do not break this loop. Otherwise, litellm will not be able to run callbacks.
-        async for chunk in response:
-            assert chunk.__class__.__name__ == "ModelResponseStream"
-            assert len(chunk.choices) == 1
-            choice = chunk.choices[0]
-            events = builder.write(choice.delta)
-            for event in events:
-                await reply.add_chunk(event.chunk, field=event.name)
-
-            if finish_reason := choice.finish_reason:
-                message = builder.getvalue()
-                if finish_reason not in ("stop", "tool_calls"):
-                    raise NotImplementedError(f"finish_reason={finish_reason}")
-                await reply.end()
-
-        if not message:
-            raise Exception("Stream ended unexpectedly")
-
-        return message
+        # Waits for a slot of the model and provider. Held until the stream is read.
+        async with admission.admit(self.model, self.priority):
+            response = await acompletion(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                metadata={
+                    "existing_trace_id": langfuse_context.get_current_trace_id(),
+                    "parent_observation_id": langfuse_context.get_current_observation_id(),
+                },
+                **kwargs,
+            )
+            assert isinstance(response, CustomStreamWrapper)
+
+            # We start by sending a begin_message event to the web client.
+            # This will cause the web client to draw a new message box for the assistant.
+            reply = await chat.reply("assistant", name=self.name)
+
+            # We will aggregate delta messages and store them in this variable until we see a finish_reason.
+            # This is the only way to get the full content of the message.
+            # We'll return this value at the end of the function.
+            builder = MessageBuilder()
+
+            # We will return this value at the end of the function.
+            message: Optional[LitellmMessage] = None
+
+            # Kept for logging the partial response if the run is cancelled.
+            chunks = []
+
+            # Do not break this loop. Otherwise, litellm will not be able to run callbacks.
+            # Cancelling the run is the exception, see `_close_stream`.
+            try:
+                async for chunk in response:
+                    assert chunk.__class__.__name__ == "ModelResponseStream"
+                    assert len(chunk.choices) == 1
+                    chunks.append(chunk)
+                    choice = chunk.choices[0]
+                    events = builder.write(choice.delta)
+                    for event in events:
+                        await reply.add_chunk(event.chunk, field=event.name, index=event.index)
+
+                    if finish_reason := choice.finish_reason:
+                        message = builder.getvalue()
+                        if finish_reason not in ("stop", "tool_calls"):
+                            raise NotImplementedError(f"finish_reason={finish_reason}")
+                        await reply.end()
+            except asyncio.CancelledError:
+                # The reply is ended as truncated by whoever cancelled the run, see `Chat.truncate`.
+                await self._close_stream(response, chunks, messages)
+                raise
+
+            if not message:
+                raise Exception("Stream ended unexpectedly")
+
+            return message
+
+    async def _close_stream(self, response: CustomStreamWrapper, chunks: list, messages: list[LitellmMessage]):
+        """
+        Closes the stream of a cancelled completion, so the provider stops generating tokens.
+        litellm only runs success callbacks for streams read to the end, so they are run here with the partial response.
+        """
+        try:
+            await _close_completion_stream(response)
+        except Exception as e:
+            logger.warning(f"Error closing completion stream: {e}")
+        try:
+            partial = litellm.stream_chunk_builder(chunks, messages=messages)
+            if partial:
+                await response.logging_obj.async_success_handler(partial)
+        except Exception as e:
+            logger.warning(f"Error logging cancelled completion: {e}")
 
     def _get_messages(self, chat: Chat) -> list[LitellmMessage]:
         messages: list[LitellmMessage] = []
@@ -198,6 +248,24 @@ class Agent(Assistant):
         self.examples.append((user_message, response))
 
 
+async def _close_completion_stream(response: CustomStreamWrapper):
+    """
+    Closes the provider's stream wrapped by the response, which closes its HTTP response.
+    CustomStreamWrapper has no method for this in the locked litellm version.
+    """
+    stream = response.completion_stream
+    if stream is None:
+        return
+    if hasattr(stream, "aclose"):
+        # Async generators of litellm's own HTTP handlers
+        await stream.aclose()
+    elif hasattr(stream, "close"):
+        # Streams of the OpenAI client
+        result = stream.close()
+        if inspect.isawaitable(result):
+            await result
+
+
 def tool_call_from_litellm(tool_call: LitellmToolCall):
     return ToolCall(
         id=tool_call.id,
@@ -214,22 +282,21 @@ def tool_call_to_litellm(self: ToolCall):
 
 
 def message_from_litellm(message: LitellmMessage, *, name: str):
-    tool_call = None
+    tool_calls = None
     if message.tool_calls:
-        assert len(message.tool_calls) == 1
-        tool_call = tool_call_from_litellm(message.tool_calls[0])
+        tool_calls = [tool_call_from_litellm(tool_call) for tool_call in message.tool_calls]
     return Message(
         role=message.role,  # type: ignore
         name=name,
         content=message.content or "",
-        tool_call=tool_call,
+        tool_calls=tool_calls,
         tool_call_id=message.get("tool_call_id"),
     )
 
 
 def message_to_litellm(self: Message):
-    if self.tool_call:
-        tool_calls = [tool_call_to_litellm(self.tool_call)]
+    if self.tool_calls:
+        tool_calls = [tool_call_to_litellm(tool_call) for tool_call in self.tool_calls]
     else:
         tool_calls = None
     return LitellmMessage(
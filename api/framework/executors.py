@@ -0,0 +1,95 @@
+"""
+Runs tools off the event loop, so a blocking tool does not stall streaming for every other chat.
+Synchronous tools run in a thread pool by default. CPU-bound tools can run in a process pool instead.
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Literal, Optional
+
+# How a tool runs. "inline" runs it on the event loop, which is only suitable for coroutines and quick functions.
+Execution = Literal["inline", "thread", "process"]
+
+
+class ToolExecutor:
+    """
+    A pool of at most `max_workers` threads or processes. Calls beyond that wait in a queue.
+    The pool is created on first use.
+    """
+
+    def __init__(self, kind: Literal["thread", "process"], max_workers: int):
+        self.kind = kind
+        self.max_workers = max_workers
+        self.running = 0
+        self.queued = 0
+        self.completed = 0
+        self._pool: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def run(self, func: Callable[..., Any], /, **kwargs: Any) -> Any:
+        """Runs the function in the pool and waits for the result."""
+        loop = asyncio.get_running_loop()
+        if not self._slots:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        # Waiting here instead of in the pool's own queue, so queued calls can be counted and cancelled.
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.running += 1
+        try:
+            future = self._get_pool().submit(func, **kwargs)
+        except BaseException:
+            self._done()
+            raise
+        # A cancelled caller cannot stop a running function, so the slot is held until it returns.
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._done))
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self) -> None:
+        """Stops the pool without waiting for running functions. Called when the app shuts down."""
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "workers": self.max_workers,
+            "running": self.running,
+            "queued": self.queued,
+            "completed": self.completed,
+        }
+
+    def _get_pool(self) -> Executor:
+        if not self._pool:
+            if self.kind == "thread":
+                self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="tool")
+            else:
+                # Forking a process with a running event loop and its threads is not safe.
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _done(self) -> None:
+        self.running -= 1
+        self.completed += 1
+        self._slots.release()  # type: ignore
+
+
+# Shared by all function toolkits in the process
+executors = {
+    "thread": ToolExecutor("thread", int(os.getenv("TOOL_THREAD_WORKERS", 16))),
+    "process": ToolExecutor("process", int(os.getenv("TOOL_PROCESS_WORKERS", os.cpu_count() or 1))),
+}
+
+
+def stats() -> dict[str, dict[str, int]]:
+    """Returns counters of each pool for monitoring."""
+    return {kind: executor.stats() for kind, executor in executors.items()}
+
+
+def shutdown() -> None:
+    for executor in executors.values():
+        executor.shutdown()
@@ -2,19 +2,28 @@ import asyncio
 import json
 from abc import ABC, abstractmethod
 from inspect import Parameter, getdoc, signature
-from typing import Callable, get_type_hints
+from typing import Awaitable, Callable, Optional, get_type_hints
 
 import docstring_parser
 from litellm import ChatCompletionMessageToolCall, Message
+from litellm.types.utils import Function
 from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
+from mcp.types import CallToolResult
+from mcp.types import Tool as MCPTool
 from openai import pydantic_function_tool
 from openai.types.chat import ChatCompletionToolParam
 from openai.types.shared_params import FunctionDefinition
-from pydantic import Field, create_model
+from pydantic import BaseModel, Field, create_model
 
 from logger import logger
 
+from .executors import Execution, executors
+from .mcp_sessions import sessions
+from .tool_cache import cache as result_cache
+
+# Cached tool calls in progress by key, so identical calls made at the same time run once.
+_in_flight: dict[str, asyncio.Future[str]] = {}
+
 
 class Toolkit(ABC):
     """Manages the list of tools to be passed into completion reqeust."""
@@ -26,6 +35,31 @@ class Toolkit(ABC):
     async def handle_tool_calls(self, tool_calls: list[ChatCompletionMessageToolCall]) -> list[Message]: ...
 
 
+class ToolOptions(BaseModel):
+    """Options of a function in a FunctionToolkit. Set with the `tool` decorator."""
+
+    # Coroutines run inline by default, other functions in the thread pool. See `executors`.
+    execution: Optional[Execution] = None
+    # Seconds to cache results for the same arguments. Not cached by default. See `tool_cache`.
+    cache_ttl: Optional[float] = None
+    # Functions that change something, such as placing an order, are never cached.
+    side_effects: bool = False
+
+
+def tool(*, execution: Optional[Execution] = None, cache_ttl: Optional[float] = None, side_effects: bool = False):
+    """
+    Decorator that sets how a function of a FunctionToolkit is run.
+    Use "process" for CPU-bound functions, and "inline" for quick ones that do not block.
+    Set `cache_ttl` only for functions without side effects, and mark the others with `side_effects`.
+    """
+
+    def decorator(func):
+        func.tool_options = ToolOptions(execution=execution, cache_ttl=cache_ttl, side_effects=side_effects)
+        return func
+
+    return decorator
+
+
 class FunctionToolkit(Toolkit):
     """Manages the list of tools to be passed into completion reqeust."""
 
@@ -33,44 +67,125 @@ class FunctionToolkit(Toolkit):
         self.functions = {f.__name__: f for f in functions}
         self.models = {f.__name__: function_to_pydantic_model(f) for f in functions}
         self.tools = [pydantic_function_tool(model) for model in self.models.values()]
+        self.executions = {f.__name__: _get_execution(f) for f in functions}
+        self.cache_ttls = {f.__name__: _get_cache_ttl(f) for f in functions}
 
     async def get_tools(self) -> list[ChatCompletionToolParam]:
         """Returns the list of tools to be passed into completion reqeust."""
         return self.tools
 
     async def handle_tool_calls(self, tool_calls: list[ChatCompletionMessageToolCall]) -> list[Message]:
-        """This is called each time a response is received from completion method."""
+        """This is called each time a response is received from completion method. Calls are run concurrently."""
         logger.info("Number of tool calls: %s", len(tool_calls))
-        messages = []
-        for tool_call in tool_calls:
-            function = tool_call.function
-            assert isinstance(function.name, str)
-            logger.info("Tool call: %s(%s)", function.name, function.arguments)
-            func = self.functions[function.name]
-            model = self.models[function.name]
-            instance = model.model_validate_json(tool_call.function.arguments)
-            kwargs = {name: getattr(instance, name) for name in model.model_fields}
-
-            # Fill in default values
-            for param in signature(func).parameters.values():
-                if kwargs[param.name] is None and param.default is not Parameter.empty:
-                    kwargs[param.name] = param.default
-
-            if asyncio.iscoroutinefunction(func):
-                result = await func(**kwargs)
-            else:
-                result = func(**kwargs)
-
-            logger.info("%s call result: %s", function.name, result)
-            messages.append(
-                Message(
-                    role="tool",  # type: ignore
-                    tool_call_id=tool_call.id,
-                    content=result if isinstance(result, str) else json.dumps(result),
-                )
-            )
+        return await asyncio.gather(*(self._handle_tool_call(tool_call) for tool_call in tool_calls))
+
+    async def _handle_tool_call(self, tool_call: ChatCompletionMessageToolCall) -> Message:
+        function = tool_call.function
+        assert isinstance(function.name, str)
+        logger.info("Tool call: %s(%s)", function.name, function.arguments)
+        func = self.functions[function.name]
+        content = None
+        key = None
+        ttl = self.cache_ttls[function.name]
+        if ttl:
+            # Functions of different modules may have the same name.
+            key = result_cache.make_key(f"{func.__module__}.{func.__qualname__}", function.arguments)
+        if key:
+            content = await result_cache.get(key)
+        if content is not None:
+            logger.info("%s result from cache", function.name)
+        elif key:
+
+            async def call() -> tuple[str, bool]:
+                return await self._call_function(function), True
+
+            content = await _call_once(key, ttl, call)  # type: ignore
+        else:
+            content = await self._call_function(function)
+        return Message(
+            role="tool",  # type: ignore
+            tool_call_id=tool_call.id,
+            content=content,
+        )
+
+    async def _call_function(self, function: Function) -> str:
+        func = self.functions[function.name]  # type: ignore
+        model = self.models[function.name]  # type: ignore
+        instance = model.model_validate_json(function.arguments)
+        kwargs = {name: getattr(instance, name) for name in model.model_fields}
+
+        # Fill in default values
+        for param in signature(func).parameters.values():
+            if kwargs[param.name] is None and param.default is not Parameter.empty:
+                kwargs[param.name] = param.default
+
+        execution = self.executions[function.name]  # type: ignore
+        if execution != "inline":
+            result = await executors[execution].run(func, **kwargs)
+        elif asyncio.iscoroutinefunction(func):
+            result = await func(**kwargs)
+        else:
+            result = func(**kwargs)
+
+        logger.info("%s call result: %s", function.name, result)
+        return result if isinstance(result, str) else json.dumps(result)
 
-        return messages
+
+async def _call_once(key: str, ttl: float, call: Callable[[], Awaitable[tuple[str, bool]]]) -> str:
+    """
+    Calls a tool whose result is cached under `key`. `call` returns the result and whether to cache it.
+    If a call with the same key is in progress, waits for its result instead of calling the tool again.
+    """
+    while (future := _in_flight.get(key)) is not None:
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Only the first caller was cancelled, so call the tool again.
+            if not future.cancelled():
+                raise
+
+    future = asyncio.get_running_loop().create_future()
+    # Without waiters, an exception of the call would be logged as never retrieved.
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _in_flight[key] = future
+    try:
+        content, cacheable = await call()
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        del _in_flight[key]
+    future.set_result(content)
+    if cacheable:
+        try:
+            await result_cache.put(key, content, ttl)
+        except Exception as e:
+            # The call succeeded, so its result is returned even if it cannot be cached.
+            logger.warning("Error caching result: %s", e)
+    return content
+
+
+def _get_options(func: Callable) -> ToolOptions:
+    return getattr(func, "tool_options", None) or ToolOptions()
+
+
+def _get_execution(func: Callable) -> Execution:
+    options = _get_options(func)
+    if asyncio.iscoroutinefunction(func):
+        if options.execution not in (None, "inline"):
+            raise ValueError(f"Coroutine function {func.__name__} must run inline")
+        return "inline"
+    return options.execution or "thread"
+
+
+def _get_cache_ttl(func: Callable) -> Optional[float]:
+    options = _get_options(func)
+    if options.side_effects and options.cache_ttl:
+        raise ValueError(f"Function {func.__name__} has side effects and cannot be cached")
+    return options.cache_ttl
 
 
 def function_to_pydantic_model(func):
@@ -102,50 +217,91 @@ def function_to_pydantic_model(func):
 
 
 class MCPToolkit(Toolkit):
+    """Provides the tools of an MCP server. Servers are kept running between calls, see `mcp_sessions`."""
 
-    def __init__(self, command: str, args: list[str] = []):
+    def __init__(
+        self, command: str, args: list[str] = [], cache_ttls: dict[str, float] = {}, side_effects: list[str] = []
+    ):
+        """
+        `cache_ttls` are seconds to cache results of tools by name. Only for tools without side effects.
+        `side_effects` names the tools that change something, which are never cached.
+        """
+        if cached := set(cache_ttls) & set(side_effects):
+            raise ValueError(f"Tools with side effects cannot be cached: {', '.join(sorted(cached))}")
         self.server_params = StdioServerParameters(command=command, args=args)
+        self.cache_ttls = cache_ttls
 
     async def get_tools(self) -> list[ChatCompletionToolParam]:
-        async with stdio_client(self.server_params) as (read, write):
-            async with ClientSession(read, write) as session:
-                await session.initialize()
-                out = []
-                tools = await session.list_tools()
-                logger.info(f"Got {len(tools.tools)} tools.")
-                for tool in tools.tools:
-                    schema = dict(tool.inputSchema)
-                    schema["required"] = list(schema["properties"].keys())
-                    schema["additionalProperties"] = False
-                    param = ChatCompletionToolParam(
-                        type="function",
-                        function=FunctionDefinition(
-                            name=tool.name,
-                            description=tool.description or "",
-                            parameters=schema,
-                            strict=True,
-                        ),
-                    )
-                    out.append(param)
-                return out
+        """Returns the tools of the server. Cached, see `MCPServerPool.list_tools`."""
+        return await sessions.get_pool(self.server_params).list_tools(self._convert_tools)
+
+    @staticmethod
+    def _convert_tools(tools: list[MCPTool]) -> list[ChatCompletionToolParam]:
+        logger.info(f"Got {len(tools)} tools.")
+        out = []
+        for tool in tools:
+            schema = dict(tool.inputSchema)
+            schema["required"] = list(schema["properties"].keys())
+            schema["additionalProperties"] = False
+            param = ChatCompletionToolParam(
+                type="function",
+                function=FunctionDefinition(
+                    name=tool.name,
+                    description=tool.description or "",
+                    parameters=schema,
+                    strict=True,
+                ),
+            )
+            out.append(param)
+        return out
 
     async def handle_tool_calls(self, tool_calls: list[ChatCompletionMessageToolCall]) -> list[Message]:
-        async with stdio_client(self.server_params) as (read, write):
-            async with ClientSession(read, write) as session:
-                await session.initialize()
-                output = []
-                for tool_call in tool_calls:
-                    logger.info(f"Executing tool call: {tool_call}")
-                    arguments = json.loads(tool_call.function.arguments)
-                    assert isinstance(arguments, dict)
-                    assert isinstance(tool_call.function.name, str)
-                    result = await session.call_tool(tool_call.function.name, arguments=arguments)
-                    logger.debug(f"Result: {result}")
-                    output.append(
-                        {
-                            "role": "tool",
-                            "content": str(result),
-                            "tool_call_id": tool_call.id,
-                        }
-                    )
-                return output
+        """Calls the tools concurrently. Requests share one session, the server handles them as they arrive."""
+        keys = [self._cache_key(tool_call) for tool_call in tool_calls]
+        contents = [await result_cache.get(key) if key else None for key in keys]
+        misses = [i for i, content in enumerate(contents) if content is None]
+        if misses:
+            # No server is needed if all results are cached.
+            async with sessions.get_pool(self.server_params).session() as session:
+                results = await asyncio.gather(*(self._call_uncached(session, tool_calls[i], keys[i]) for i in misses))
+            for i, content in zip(misses, results):
+                contents[i] = content
+        return [
+            Message(
+                role="tool",  # type: ignore
+                tool_call_id=tool_call.id,
+                content=content,
+            )
+            for tool_call, content in zip(tool_calls, contents)
+        ]
+
+    async def _call_uncached(
+        self, session: ClientSession, tool_call: ChatCompletionMessageToolCall, key: Optional[str]
+    ) -> str:
+        """Calls the tool. With a `key`, successful results are cached and identical calls in progress run once."""
+
+        async def call() -> tuple[str, bool]:
+            result = await self._call_tool(session, tool_call)
+            return str(result), not result.isError
+
+        if key is None:
+            content, _ = await call()
+            return content
+        return await _call_once(key, self.cache_ttls[tool_call.function.name], call)  # type: ignore
+
+    def _cache_key(self, tool_call: ChatCompletionMessageToolCall) -> Optional[str]:
+        name = tool_call.function.name
+        if not self.cache_ttls.get(name):  # type: ignore
+            return None
+        command = " ".join([self.server_params.command, *self.server_params.args])
+        return result_cache.make_key(f"{command}:{name}", tool_call.function.arguments)
+
+    @staticmethod
+    async def _call_tool(session: ClientSession, tool_call: ChatCompletionMessageToolCall) -> CallToolResult:
+        logger.info(f"Executing tool call: {tool_call}")
+        arguments = json.loads(tool_call.function.arguments)
+        assert isinstance(arguments, dict)
+        assert isinstance(tool_call.function.name, str)
+        result = await session.call_tool(tool_call.function.name, arguments=arguments)
+        logger.debug(f"Result: {result}")
+        return result
@@ -0,0 +1,254 @@
+"""
+Keeps MCP servers running between tool calls.
+Starting a server, often with `npx -y` or `uv run`, takes much longer than the tool calls themselves.
+"""
+
+import asyncio
+import contextlib
+import os
+import time
+from typing import AsyncIterator, Callable, Optional, TypeVar
+
+from mcp import ClientSession, StdioServerParameters, types
+from mcp.client.stdio import stdio_client
+
+from logger import logger
+
+T = TypeVar("T")
+
+
+class MCPServer:
+    """
+    One server process with an initialized session.
+
+    The stdio client and the session are entered and exited by a background task,
+    because their cancel scopes must be exited by the task that entered them.
+    """
+
+    def __init__(self, params: StdioServerParameters, on_tools_changed: Callable[[], None]):
+        self.params = params
+        self.on_tools_changed = on_tools_changed
+        self.session: Optional[ClientSession] = None
+        self._ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def alive(self) -> bool:
+        return not self._task.done() and not self._stop.is_set()
+
+    async def start(self, timeout: float) -> None:
+        """Waits until the session is initialized. Raises the error if the server fails to start."""
+        try:
+            async with asyncio.timeout(timeout):
+                await asyncio.shield(self._ready)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def ping(self, timeout: float) -> bool:
+        try:
+            async with asyncio.timeout(timeout):
+                await self.session.send_ping()  # type: ignore
+            return True
+        except Exception as e:
+            logger.warning(f"MCP server {self.params.command} is not responding: {e}")
+            return False
+
+    async def close(self) -> None:
+        self._stop.set()
+        if not self._ready.done():
+            # Still starting, so it is not waiting for the stop event.
+            self._task.cancel()
+        await asyncio.wait([self._task])
+
+    async def _run(self):
+        try:
+            async with stdio_client(self.params) as (read, write):
+                async with ClientSession(read, write, message_handler=self._handle_message) as session:
+                    await session.initialize()
+                    self.session = session
+                    self._ready.set_result(None)
+                    await self._stop.wait()
+        except Exception as e:
+            if not self._ready.done():
+                self._ready.set_exception(e)
+            else:
+                logger.warning(f"MCP server {self.params.command} exited: {e}")
+        finally:
+            self.session = None
+            if not self._ready.done():
+                self._ready.cancel()
+
+    async def _handle_message(self, message):
+        # ServerNotification wraps the notification in `root`.
+        if isinstance(getattr(message, "root", message), types.ToolListChangedNotification):
+            logger.info(f"Tools of MCP server {self.params.command} changed")
+            self.on_tools_changed()
+
+
+class MCPServerPool:
+    """
+    Up to `size` running servers of one configuration. Each caller gets a server of its own until it is done with it.
+    Servers are started when needed and replaced when they exit or stop responding.
+
+    The list of tools is cached for `tools_ttl` seconds, or until a server notifies that it changed.
+    """
+
+    def __init__(self, params: StdioServerParameters, size: int, start_timeout: float, tools_ttl: float):
+        self.params = params
+        self.size = size
+        self.start_timeout = start_timeout
+        self.tools_ttl = tools_ttl
+        self._idle: list[MCPServer] = []
+        self._count = 0
+        self._available = asyncio.Condition()
+        self._closed = False
+        self._tools = None
+        self._tools_expire_at = 0.0
+        # Incremented when the tools change, so lists that were in progress are not cached.
+        self._tools_generation = 0
+
+    @contextlib.asynccontextmanager
+    async def session(self) -> AsyncIterator[ClientSession]:
+        server = await self._checkout()
+        try:
+            yield server.session  # type: ignore
+        except BaseException:
+            # Tools report their errors in results, so errors here mean the server is broken, e.g. it exited.
+            # A cancelled caller might also have left a request in progress.
+            await self._discard(server)
+            raise
+        await self._checkin(server)
+
+    async def list_tools(self, convert: Callable[[list[types.Tool]], T]) -> T:
+        """Returns the tools of the server converted with `convert`, from the cache if possible."""
+        if self._tools is not None and time.monotonic() < self._tools_expire_at:
+            return self._tools
+        generation = self._tools_generation
+        async with self.session() as session:
+            result = await session.list_tools()
+        tools = convert(result.tools)
+        if generation == self._tools_generation:
+            self._tools = tools
+            self._tools_expire_at = time.monotonic() + self.tools_ttl
+        return tools
+
+    def invalidate_tools(self) -> None:
+        self._tools = None
+        self._tools_generation += 1
+
+    async def check(self, timeout: float) -> None:
+        """Pings the idle servers and replaces those that do not respond."""
+        for server in list(self._idle):
+            if server.alive and await server.ping(timeout):
+                continue
+            if server in self._idle:
+                self._idle.remove(server)
+                await self._discard(server)
+                # Replace it, so the next caller does not wait for a server to start.
+                with contextlib.suppress(Exception):
+                    if replacement := await self._start(wait=False):
+                        await self._checkin(replacement)
+
+    async def close(self) -> None:
+        # Servers in use are closed when they are returned.
+        self._closed = True
+        servers, self._idle = self._idle, []
+        await asyncio.gather(*(server.close() for server in servers))
+
+    async def _checkout(self) -> MCPServer:
+        return await self._start(wait=True)  # type: ignore
+
+    async def _start(self, wait: bool) -> Optional[MCPServer]:
+        """
+        Returns an idle server or starts a new one if there are fewer than `size`.
+        Otherwise waits for a server to become idle, or returns None if `wait` is False.
+        """
+        async with self._available:
+            while True:
+                while self._idle:
+                    server = self._idle.pop()
+                    if server.alive:
+                        return server
+                    self._count -= 1
+                    await server.close()
+                if self._count < self.size:
+                    self._count += 1
+                    break
+                if not wait:
+                    return None
+                await self._available.wait()
+        try:
+            logger.info(f"Starting MCP server: {self.params.command} {' '.join(self.params.args)}")
+            server = MCPServer(self.params, on_tools_changed=self.invalidate_tools)
+            await server.start(self.start_timeout)
+            return server
+        except BaseException:
+            await self._release_slot()
+            raise
+
+    async def _checkin(self, server: MCPServer):
+        if self._closed or not server.alive:
+            await self._discard(server)
+            return
+        async with self._available:
+            self._idle.append(server)
+            self._available.notify()
+
+    async def _discard(self, server: MCPServer):
+        await server.close()
+        await self._release_slot()
+
+    async def _release_slot(self):
+        async with self._available:
+            self._count -= 1
+            self._available.notify()
+
+
+class MCPSessionManager:
+    """Holds a pool of servers for each server configuration and checks their health in the background."""
+
+    def __init__(self, *, pool_size: int, start_timeout: float, health_interval: float, tools_ttl: float):
+        self.pool_size = pool_size
+        self.start_timeout = start_timeout
+        self.health_interval = health_interval
+        self.tools_ttl = tools_ttl
+        self._pools: dict[tuple, MCPServerPool] = {}
+        self._health_task: Optional[asyncio.Task] = None
+
+    def get_pool(self, params: StdioServerParameters) -> MCPServerPool:
+        key = (params.command, tuple(params.args), tuple(sorted((params.env or {}).items())), params.cwd)
+        pool = self._pools.get(key)
+        if not pool:
+            pool = self._pools[key] = MCPServerPool(params, self.pool_size, self.start_timeout, self.tools_ttl)
+        if not self._health_task:
+            self._health_task = asyncio.create_task(self._check_health())
+        return pool
+
+    async def close(self) -> None:
+        """Stops all servers. Called when the app shuts down."""
+        if self._health_task:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        pools, self._pools = list(self._pools.values()), {}
+        await asyncio.gather(*(pool.close() for pool in pools))
+
+    async def _check_health(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for pool in list(self._pools.values()):
+                try:
+                    await pool.check(timeout=self.health_interval / 2)
+                except Exception as e:
+                    logger.error(f"Error checking MCP servers: {e}")
+
+
+# Shared by all MCP toolkits in the process
+sessions = MCPSessionManager(
+    pool_size=int(os.getenv("MCP_POOL_SIZE", 2)),
+    start_timeout=float(os.getenv("MCP_START_TIMEOUT", 60)),
+    health_interval=float(os.getenv("MCP_HEALTH_INTERVAL", 30)),
+    tools_ttl=float(os.getenv("MCP_TOOLS_TTL", 300)),
+)
@@ -0,0 +1,27 @@
+"""
+SQLite databases shared by threads, used by `tool_cache` and the chat storage of the app.
+"""
+
+import os
+import sqlite3
+import threading
+
+
+class Database:
+    """SQLite database in WAL mode. Each thread gets its own connection, so readers never block writers."""
+
+    def __init__(self, path: str, schema: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        with self.connection() as conn:
+            conn.executescript(schema)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
@@ -16,6 +16,7 @@ EventType = Literal["content", "tool_call.id", "tool_call.name", "tool_call.argu
 class Event(BaseModel):
     name: EventType
     chunk: str
+    index: int = 0  # Index of the tool call for tool_call.* events
 
 
 class MessageBuilder:
@@ -25,26 +26,33 @@ class MessageBuilder:
         self.values = Values(
             message_role=StrValue(),
             message_content=StrValue("content", streamable=True),
-            tool_call_id=StrValue("tool_call.id"),
-            tool_call_type=StrValue(),
-            function_name=StrValue("tool_call.name", streamable=True),
-            function_arguments=StrValue("tool_call.arguments", streamable=True),
         )
+        # Values of each tool call by its index. Tool calls may be streamed in turns or interleaved.
+        self.tool_calls: dict[int, Values] = {}
 
     def write(self, delta: Delta) -> list[Event]:
         """Apply a delta to the current state of the builder."""
         self.values.write("message_role", delta.role)
         self.values.write("message_content", delta.content)
-        if delta.tool_calls:
-            assert len(delta.tool_calls) == 1
-            tool_call = delta.tool_calls[0]
-            assert tool_call.index == 0
-            self.values.write("tool_call_id", tool_call.id)
-            self.values.write("tool_call_type", tool_call.type)
-            self.values.write("function_name", tool_call.function.name)
-            self.values.write("function_arguments", tool_call.function.arguments)
+        events = self.values.getevents()
+        for tool_call in delta.tool_calls or []:
+            values = self.tool_calls.get(tool_call.index)
+            if not values:
+                values = self.tool_calls[tool_call.index] = Values(
+                    tool_call_id=StrValue("tool_call.id"),
+                    tool_call_type=StrValue(),
+                    function_name=StrValue("tool_call.name", streamable=True),
+                    function_arguments=StrValue("tool_call.arguments", streamable=True),
+                )
+            values.write("tool_call_id", tool_call.id)
+            values.write("tool_call_type", tool_call.type)
+            values.write("function_name", tool_call.function.name)
+            values.write("function_arguments", tool_call.function.arguments)
+            for event in values.getevents():
+                event.index = tool_call.index
+                events.append(event)
 
-        return self.values.getevents()
+        return events
 
     def getvalue(self) -> Message:
         """Construct a Message object from the current state of the builder."""
@@ -52,16 +60,17 @@ class MessageBuilder:
             role=self.values["message_role"],  # type: ignore
             content=self.values["message_content"],
         )
-        if self.values["tool_call_id"]:
+        if self.tool_calls:
             message.tool_calls = [
                 ChatCompletionMessageToolCall(
-                    id=self.values["tool_call_id"],
-                    type=self.values["tool_call_type"],
+                    id=values["tool_call_id"],
+                    type=values["tool_call_type"],
                     function=Function(
-                        name=self.values["function_name"],
-                        arguments=self.values["function_arguments"],
+                        name=values["function_name"],
+                        arguments=values["function_arguments"],
                     ),
                 )
+                for _, values in sorted(self.tool_calls.items())
             ]
         return message
 
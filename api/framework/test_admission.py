@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from .admission import AdmissionController, Limiter, QueueFull
+
+
+@pytest.mark.asyncio
+async def test_interactive_before_background():
+    limiter = Limiter("model", concurrency=1, max_queue=10, retry_after=5)
+    order = []
+
+    async def work(name: str, priority):
+        await limiter.acquire(priority)
+        order.append(name)
+        await asyncio.sleep(0.01)
+        limiter.release()
+
+    await limiter.acquire("interactive")
+    tasks = [
+        asyncio.create_task(work("title", "background")),
+        asyncio.create_task(work("first", "interactive")),
+        asyncio.create_task(work("second", "interactive")),
+    ]
+    await asyncio.sleep(0.01)
+    assert limiter.stats() == {"active": 1, "waiting": 3, "rejected": 0}
+    limiter.release()
+    await asyncio.gather(*tasks)
+    assert order == ["first", "second", "title"]
+    assert limiter.active == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_full():
+    limiter = Limiter("model", concurrency=1, max_queue=1, retry_after=7)
+    await limiter.acquire("interactive")
+    waiter = asyncio.create_task(limiter.acquire("interactive"))
+    await asyncio.sleep(0)
+    with pytest.raises(QueueFull) as e:
+        await limiter.acquire("interactive")
+    assert e.value.retry_after == 7
+    assert limiter.rejected == 1
+
+    # Cancelled waiters leave the queue.
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert limiter.waiting == 0
+    limiter.release()
+    assert limiter.active == 0
+
+
+@pytest.mark.asyncio
+async def test_provider_limit():
+    admission = AdmissionController(model_concurrency=2, provider_concurrency=1, max_queue=10, retry_after=5)
+    running = []
+
+    async def complete(model: str):
+        async with admission.admit(model):
+            running.append(model)
+            await asyncio.sleep(0.01)
+            assert len(running) == 1
+            running.remove(model)
+
+    # Different models of the same provider share the provider's slot.
+    await asyncio.gather(complete("gpt-4.1"), complete("gpt-4.1-nano"), complete("gpt-4.1"))
+    stats = admission.stats()
+    assert stats["providers"] == {"openai": {"active": 0, "waiting": 0, "rejected": 0}}
+    assert set(stats["models"]) == {"gpt-4.1", "gpt-4.1-nano"}
@@ -0,0 +1,62 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from .executors import ToolExecutor
+
+
+def wait(event: threading.Event) -> str:
+    assert event.wait(timeout=5)
+    return threading.current_thread().name
+
+
+def get_pid() -> int:
+    return os.getpid()
+
+
+@pytest.mark.asyncio
+async def test_thread_pool_is_bounded():
+    executor = ToolExecutor("thread", max_workers=2)
+    event = threading.Event()
+    try:
+        tasks = [asyncio.create_task(executor.run(wait, event=event)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        assert executor.stats() == {"workers": 2, "running": 2, "queued": 1, "completed": 0}
+
+        event.set()
+        names = await asyncio.gather(*tasks)
+        assert all(name.startswith("tool") for name in names)
+        assert executor.stats() == {"workers": 2, "running": 0, "queued": 0, "completed": 3}
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_call_holds_slot_until_it_returns():
+    executor = ToolExecutor("thread", max_workers=1)
+    event = threading.Event()
+    try:
+        task = asyncio.create_task(executor.run(wait, event=event))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The function is still running in its thread.
+        assert executor.running == 1
+
+        event.set()
+        await asyncio.sleep(0.01)
+        assert executor.running == 0
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_process_pool():
+    executor = ToolExecutor("process", max_workers=1)
+    try:
+        assert await executor.run(get_pid) != os.getpid()
+    finally:
+        executor.shutdown()
@@ -1,8 +1,13 @@
+import asyncio
+import sqlite3
+import time
+
 import pytest
 from litellm import ChatCompletionMessageToolCall
 from litellm.types.utils import Function
 
-from .function_calling import FunctionToolkit
+from .function_calling import FunctionToolkit, MCPToolkit, tool
+from .tool_cache import cache as result_cache
 
 
 async def _test_function(f, args: str):
@@ -163,3 +168,128 @@ async def test_function_calling_with_coroutines():
 
     result = await _test_function(async_with_args, '{"a": 5, "b": 3}')
     assert result == "8"
+
+
+@pytest.mark.asyncio
+async def test_tool_calls_run_concurrently():
+    both_started = asyncio.Event()
+    started = []
+
+    async def wait(name: str):
+        started.append(name)
+        if len(started) == 2:
+            both_started.set()
+        await asyncio.wait_for(both_started.wait(), timeout=1)
+        return name
+
+    toolkit = FunctionToolkit([wait])
+    messages = await toolkit.handle_tool_calls(
+        [
+            ChatCompletionMessageToolCall(id="call_a", function=Function(name="wait", arguments='{"name": "a"}')),
+            ChatCompletionMessageToolCall(id="call_b", function=Function(name="wait", arguments='{"name": "b"}')),
+        ]
+    )
+    # Results are in the order of the calls.
+    assert [(message["tool_call_id"], message["content"]) for message in messages] == [("call_a", "a"), ("call_b", "b")]
+
+
+@pytest.mark.asyncio
+async def test_sync_functions_do_not_block_the_loop():
+    def blocking():
+        time.sleep(0.2)
+        return "done"
+
+    toolkit = FunctionToolkit([blocking])
+    call = asyncio.create_task(
+        toolkit.handle_tool_calls([ChatCompletionMessageToolCall(function=Function(name="blocking", arguments="{}"))])
+    )
+    # The loop keeps running while the function sleeps in a thread.
+    await asyncio.sleep(0.05)
+    assert not call.done()
+    messages = await call
+    assert messages[0]["content"] == "done"
+
+
+def test_coroutines_run_inline():
+    @tool(execution="thread")
+    async def coroutine():
+        pass
+
+    with pytest.raises(ValueError):
+        FunctionToolkit([coroutine])
+
+
+@pytest.mark.asyncio
+async def test_results_are_cached_when_opted_in():
+    calls = []
+
+    @tool(cache_ttl=60)
+    def lookup(query: str):
+        calls.append(query)
+        return f"result of {query}"
+
+    def save(query: str):
+        calls.append(query)
+
+    toolkit = FunctionToolkit([lookup, save])
+    assert await _call(toolkit, "lookup", '{"query": "cached"}') == "result of cached"
+    assert await _call(toolkit, "lookup", '{ "query":"cached" }') == "result of cached"
+    assert calls == ["cached"]
+
+    # Functions without a TTL are called every time.
+    await _call(toolkit, "save", '{"query": "saved"}')
+    await _call(toolkit, "save", '{"query": "saved"}')
+    assert calls == ["cached", "saved", "saved"]
+
+
+@pytest.mark.asyncio
+async def test_identical_cached_calls_run_once():
+    calls = []
+
+    @tool(cache_ttl=60)
+    async def lookup(query: str):
+        calls.append(query)
+        await asyncio.sleep(0.01)
+        return f"result of {query}"
+
+    toolkit = FunctionToolkit([lookup])
+    messages = await toolkit.handle_tool_calls(
+        [
+            ChatCompletionMessageToolCall(id="call_a", function=Function(name="lookup", arguments='{"query": "same"}')),
+            ChatCompletionMessageToolCall(id="call_b", function=Function(name="lookup", arguments='{"query":"same"}')),
+        ]
+    )
+    assert [message["content"] for message in messages] == ["result of same", "result of same"]
+    assert calls == ["same"]
+
+
+@pytest.mark.asyncio
+async def test_result_is_returned_when_caching_fails(monkeypatch):
+    @tool(cache_ttl=60)
+    def lookup(query: str):
+        return f"result of {query}"
+
+    async def put(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(result_cache, "put", put)
+    toolkit = FunctionToolkit([lookup])
+    assert await _call(toolkit, "lookup", '{"query": "uncacheable"}') == "result of uncacheable"
+
+
+def test_functions_with_side_effects_are_not_cached():
+    @tool(cache_ttl=60, side_effects=True)
+    def order(item: str):
+        pass
+
+    with pytest.raises(ValueError):
+        FunctionToolkit([order])
+    with pytest.raises(ValueError):
+        MCPToolkit("server", cache_ttls={"order": 60}, side_effects=["order"])
+
+
+async def _call(toolkit: FunctionToolkit, name: str, arguments: str):
+    messages = await toolkit.handle_tool_calls(
+        [ChatCompletionMessageToolCall(function=Function(name=name, arguments=arguments))]
+    )
+    return messages[0]["content"]
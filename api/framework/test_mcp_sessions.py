@@ -0,0 +1,69 @@
+import os
+import sys
+
+import pytest
+from mcp import StdioServerParameters
+
+from .mcp_sessions import MCPSessionManager
+
+pytest.importorskip("mcp.server.fastmcp")
+
+SERVER = StdioServerParameters(
+    command=sys.executable, args=[os.path.join(os.path.dirname(__file__), "..", "mcp-servers", "test.py")]
+)
+
+
+@pytest.mark.asyncio
+async def test_servers_are_reused():
+    sessions = MCPSessionManager(pool_size=1, start_timeout=30, health_interval=60, tools_ttl=60)
+    pool = sessions.get_pool(SERVER)
+    try:
+        async with pool.session() as first:
+            result = await first.call_tool("greet", arguments={"name": "a"})
+            assert "Hello, a" in str(result)
+        async with pool.session() as second:
+            assert second is first
+        assert sessions.get_pool(StdioServerParameters(command=SERVER.command, args=list(SERVER.args))) is pool
+    finally:
+        await sessions.close()
+    assert not pool._idle
+
+
+@pytest.mark.asyncio
+async def test_dead_servers_are_replaced():
+    sessions = MCPSessionManager(pool_size=1, start_timeout=30, health_interval=60, tools_ttl=60)
+    pool = sessions.get_pool(SERVER)
+    try:
+        async with pool.session() as first:
+            pass
+        # Stop the server as if it exited.
+        await pool._idle[0].close()
+        await pool.check(timeout=5)
+        async with pool.session() as second:
+            assert second is not first
+            await second.send_ping()
+    finally:
+        await sessions.close()
+
+
+@pytest.mark.asyncio
+async def test_tools_are_cached():
+    sessions = MCPSessionManager(pool_size=1, start_timeout=30, health_interval=60, tools_ttl=60)
+    pool = sessions.get_pool(SERVER)
+    conversions = []
+
+    def convert(tools):
+        conversions.append(tools)
+        return [tool.name for tool in tools]
+
+    try:
+        assert await pool.list_tools(convert) == ["greet"]
+        assert await pool.list_tools(convert) == ["greet"]
+        assert len(conversions) == 1
+
+        # As when a server sends notifications/tools/list_changed
+        pool.invalidate_tools()
+        assert await pool.list_tools(convert) == ["greet"]
+        assert len(conversions) == 2
+    finally:
+        await sessions.close()
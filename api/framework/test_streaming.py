@@ -139,4 +139,37 @@ def test_message_builder_streaming_tool_call():
     message = builder.getvalue()
     assert message.tool_calls is not None
     assert len(message.tool_calls) == 1
-    assert message.tool_calls[0].function.arguments == '{"arg1": "value1"}'
\ No newline at end of file
+    assert message.tool_calls[0].function.arguments == '{"arg1": "value1"}'
+
+
+def test_message_builder_multiple_tool_calls():
+    builder = MessageBuilder()
+
+    events = builder.write(
+        Delta(
+            role="assistant",
+            tool_calls=[
+                {"index": 0, "id": "call_a", "type": "function", "function": {"name": "a", "arguments": '{"x"'}},
+                {"index": 1, "id": "call_b", "type": "function", "function": {"name": "b", "arguments": ""}},
+            ],
+        )
+    )
+    assert [(event.name, event.index) for event in events] == [
+        ("tool_call.id", 0),
+        ("tool_call.name", 0),
+        ("tool_call.arguments", 0),
+        ("tool_call.id", 1),
+        ("tool_call.name", 1),
+    ]
+
+    # Chunks of different tool calls may be interleaved.
+    builder.write(Delta(tool_calls=[{"index": 1, "function": {"arguments": "{}"}}]))
+    events = builder.write(Delta(tool_calls=[{"index": 0, "function": {"arguments": ": 1}"}}]))
+    assert events == [Event(name="tool_call.arguments", chunk=": 1}", index=0)]
+
+    message = builder.getvalue()
+    assert message.tool_calls is not None
+    assert [(call.id, call.function.name, call.function.arguments) for call in message.tool_calls] == [
+        ("call_a", "a", '{"x": 1}'),
+        ("call_b", "b", "{}"),
+    ]
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+from .tool_cache import ToolResultCache
+
+
+def test_keys_ignore_order_and_whitespace():
+    key = ToolResultCache.make_key("exa.search", '{"query": "a", "limit": 1}')
+    assert key == ToolResultCache.make_key("exa.search", '{"limit":1,"query":"a"}')
+    assert key != ToolResultCache.make_key("exa.search", '{"query": "b", "limit": 1}')
+    assert key != ToolResultCache.make_key("waffle.search", '{"query": "a", "limit": 1}')
+    assert ToolResultCache.make_key("exa.search", "{") is None
+
+
+@pytest.mark.asyncio
+async def test_results_expire():
+    cache = ToolResultCache(max_size=100)
+    await cache.put("a", "result", ttl=60)
+    await cache.put("b", "result", ttl=-1)
+    assert await cache.get("a") == "result"
+    assert await cache.get("b") is None
+    assert await cache.get("c") is None
+    assert cache.stats() == {"entries": 1, "size": 6, "hits": 1, "disk_hits": 0, "misses": 2, "evictions": 0}
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_are_evicted():
+    cache = ToolResultCache(max_size=10)
+    await cache.put("a", "aaaa", ttl=60)
+    await cache.put("b", "bbbb", ttl=60)
+    assert await cache.get("a") == "aaaa"
+    await cache.put("c", "cccc", ttl=60)
+    assert await cache.get("b") is None
+    assert await cache.get("a") == "aaaa"
+    assert cache.evictions == 1
+
+    # Results larger than the whole cache are not kept.
+    await cache.put("d", "d" * 11, ttl=60)
+    assert await cache.get("d") is None
+
+
+@pytest.mark.asyncio
+async def test_disk_tier(tmp_path):
+    path = str(tmp_path / "tool_cache.db")
+    await ToolResultCache(max_size=100, path=path).put("a", "result", ttl=60)
+    await ToolResultCache(max_size=100, path=path).put("b", "result", ttl=-1)
+
+    cache = ToolResultCache(max_size=100, path=path)
+    assert await cache.get("a") == "result"
+    assert await cache.get("b") is None
+    assert cache.disk_hits == 1
+
+    # Served from memory after the first hit
+    start = time.perf_counter()
+    assert await cache.get("a") == "result"
+    assert time.perf_counter() - start < 0.01
+    assert cache.disk_hits == 1
@@ -0,0 +1,136 @@
+"""
+Caches results of tool calls, so repeated lookups with the same arguments do not call the tool again.
+Tools opt in with a TTL. Tools with side effects must not, see `tool` and `MCPToolkit`.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from .sqlite import Database
+
+
+class ToolResultCache:
+    """
+    Keeps results in memory until they expire.
+    The least recently used results are evicted when their total size exceeds `max_size` characters.
+
+    With `path`, results are also saved to a SQLite database,
+    so they survive restarts and are shared by processes using the same file.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tool_results (
+            key TEXT PRIMARY KEY,
+            result TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS tool_results_expires_at ON tool_results (expires_at);
+    """
+
+    # Expired results are deleted from the database after this many writes.
+    purge_interval = 100
+
+    def __init__(self, *, max_size: int, path: Optional[str] = None):
+        self.max_size = max_size
+        self._results: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._size = 0
+        self._db = Database(path, self.SCHEMA) if path else None
+        self._writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(tool: str, arguments: str) -> Optional[str]:
+        """
+        Returns the key of a call to `tool` with JSON `arguments`, or None if they are not valid JSON.
+        Arguments that differ only in the order of keys or in whitespace have the same key.
+        """
+        try:
+            canonical = json.dumps(json.loads(arguments), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        except ValueError:
+            return None
+        return hashlib.sha256(f"{tool}\0{canonical}".encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        entry = self._results.get(key)
+        if entry and entry[0] <= now:
+            self._remove(key)
+            entry = None
+        if entry:
+            self._results.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if self._db:
+            row = await asyncio.to_thread(self._load, key, now)
+            if row:
+                expires_at, result = row
+                self._put(key, expires_at, result)
+                self.hits += 1
+                self.disk_hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, result: str, ttl: float) -> None:
+        expires_at = time.time() + ttl
+        self._put(key, expires_at, result)
+        if self._db:
+            await asyncio.to_thread(self._save, key, expires_at, result)
+
+    def stats(self) -> dict[str, int]:
+        """Returns counters for monitoring."""
+        return {
+            "entries": len(self._results),
+            "size": self._size,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _put(self, key: str, expires_at: float, result: str) -> None:
+        self._remove(key)
+        if len(result) > self.max_size:
+            return
+        self._results[key] = (expires_at, result)
+        self._size += len(result)
+        while self._size > self.max_size:
+            evicted, _ = next(iter(self._results.items()))
+            self._remove(evicted)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._results.pop(key, None)
+        if entry:
+            self._size -= len(entry[1])
+
+    def _load(self, key: str, now: float) -> Optional[tuple[float, str]]:
+        conn = self._db.connection()  # type: ignore
+        return conn.execute(
+            "SELECT expires_at, result FROM tool_results WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+
+    def _save(self, key: str, expires_at: float, result: str) -> None:
+        with self._db.connection() as conn:  # type: ignore
+            conn.execute(
+                "INSERT OR REPLACE INTO tool_results (key, result, expires_at) VALUES (?, ?, ?)",
+                (key, result, expires_at),
+            )
+            self._writes += 1
+            if self._writes % self.purge_interval == 0:
+                conn.execute("DELETE FROM tool_results WHERE expires_at <= ?", (time.time(),))
+
+
+# Shared by all toolkits in the process
+cache = ToolResultCache(
+    max_size=int(os.getenv("TOOL_CACHE_SIZE", 16 * 1024 * 1024)),
+    path=os.getenv("TOOL_CACHE_PATH") or None,
+)
@@ -0,0 +1,79 @@
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import os
+from typing import AsyncIterator, Optional
+
+
+class ChatLanes:
+    """
+    Serializes changes to each chat.
+
+    Work on a chat waits in a FIFO queue until earlier work on the same chat is done.
+    Work on different chats runs concurrently.
+
+    With `lock_dir`, a lane is also locked across processes with a lock file in the directory,
+    so workers sharing a storage do not change a chat at the same time.
+    Processes take turns in no particular order.
+    """
+
+    # Seconds between attempts to lock a file held by another process
+    poll_interval = 0.05
+
+    def __init__(self, lock_dir: Optional[str] = None):
+        self.lock_dir = lock_dir
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._pending: dict[str, int] = {}
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, chat_id: str) -> AsyncIterator[None]:
+        """
+        Wait for the turn of the caller on the chat's lane and hold it until the context exits.
+
+        Example:
+            async with lanes.acquire(chat_id):
+                state = storage.load(chat_id)
+                # modify and save state
+        """
+        lock = self._locks.get(chat_id)
+        if not lock:
+            lock = self._locks[chat_id] = asyncio.Lock()
+        self._pending[chat_id] = self._pending.get(chat_id, 0) + 1
+        try:
+            # asyncio.Lock wakes up waiters in the order they arrived.
+            async with lock:
+                if self.lock_dir:
+                    # Chat ids come from URLs, so they are hashed instead of used as file names.
+                    name = hashlib.sha256(chat_id.encode()).hexdigest() + ".lock"
+                    async with self._lock_file(os.path.join(self.lock_dir, name)):
+                        yield
+                else:
+                    yield
+        finally:
+            self._pending[chat_id] -= 1
+            if not self._pending[chat_id]:
+                del self._pending[chat_id]
+                del self._locks[chat_id]
+
+    def pending(self, chat_id: str) -> int:
+        """Returns the number of holders and waiters on the chat's lane in this process."""
+        return self._pending.get(chat_id, 0)
+
+    @contextlib.asynccontextmanager
+    async def _lock_file(self, path: str) -> AsyncIterator[None]:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # Polling instead of a blocking flock in a thread, so waiting can be cancelled.
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(self.poll_interval)
+            yield
+        finally:
+            # Closing the file releases the lock.
+            os.close(fd)
@@ -1,31 +1,68 @@
-import json
+import asyncio
+import contextlib
 import os
 import traceback
-from datetime import datetime
+import uuid
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
 import rich
-from fastapi import BackgroundTasks, Body, Depends, FastAPI, Request
+from fastapi import (
+    BackgroundTasks,
+    Body,
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+)
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from sse_starlette.event import ServerSentEvent
+from fastapi.responses import JSONResponse, Response
 from sse_starlette.sse import EventSourceResponse
 from starlette.requests import ClientDisconnect
 
+import codec
 import deps
 import models
 import tasks
 from akson import Assistant, Chat, ChatState, Message
+from cache import CachedStorage
+from framework import executors
+from framework.admission import QueueFull
+from framework.agent import admission
+from framework.mcp_sessions import sessions as mcp_sessions
+from framework.tool_cache import cache as tool_cache
 from logger import logger
-from pubsub import PubSub
+from pubsub import Event, OverflowPolicy, PubSub, Subscription
 from registry import UnknownAssistant
 from runner import Runner
+from runs import RunScheduler
+from storage import ChatStorage
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    flusher = asyncio.create_task(deps.storage.run_flusher())
+    warmer = asyncio.create_task(tasks.warm_up_tools(deps.registry))
+    await deps.pubsub.start()
+    try:
+        yield
+    finally:
+        warmer.cancel()
+        await deps.pubsub.close()
+        await mcp_sessions.close()
+        executors.shutdown()
+        flusher.cancel()
+        await asyncio.to_thread(deps.storage.flush)
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -50,81 +87,361 @@ async def unknown_assistant_exception_handler(_: Request, exc: UnknownAssistant)
     )
 
 
+@app.exception_handler(QueueFull)
+async def queue_full_exception_handler(_: Request, exc: QueueFull):
+    return JSONResponse(
+        status_code=429,
+        content={"message": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint to verify the service is running."""
     return {"status": "healthy"}
 
 
+# Distinguishes ETags from different processes, because version numbers start over when the process restarts.
+BOOT_ID = uuid.uuid4().hex[:8]
+
+
+def make_etag(version: object) -> str:
+    return f'"{BOOT_ID}-{version}"'
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Returns a 304 response if the client already has the representation with the given ETag."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if etag in tags or "*" in tags:
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+
+@app.get("/stats")
+async def get_stats():
+    """Return counters for monitoring."""
+    return {
+        "pubsub": deps.pubsub.stats(),
+        "runs": deps.runs.stats(),
+        "llm": admission.stats(),
+        "tools": executors.stats(),
+        "tool_cache": tool_cache.stats(),
+    }
+
+
 @app.get("/assistants", response_model=list[models.Assistant])
-async def get_assistants():
+async def get_assistants(request: Request, response: Response):
     """Return a list of available assistants."""
-    return [models.Assistant(name=assistant.name) for assistant in deps.registry.assistants]
+    assistants = [models.Assistant(name=assistant.name) for assistant in deps.registry.assistants]
+    # Assistants are loaded once at startup.
+    etag = make_etag("assistants")
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
+    return assistants
 
 
 @app.get("/chats", response_model=list[models.ChatSummary])
-async def get_chats():
-    """Return a list of all chat sessions."""
-    chat_files = []
-    for filename in os.listdir("chats"):
-        if filename.endswith(".json"):
-            chat_id = filename[:-5]  # Remove .json extension
-            try:
-                state = ChatState.load_from_disk(chat_id)
-
-                # Get the last modified time of the file
-                last_updated = os.path.getmtime(ChatState.file_path(chat_id))
-
-                chat_files.append(
-                    models.ChatSummary(
-                        id=chat_id,
-                        title=state.title or "Untitled Chat",
-                        last_updated=datetime.fromtimestamp(last_updated),
-                    )
-                )
-            except Exception as e:
-                logger.error(f"Error loading chat {chat_id}: {e}")
-
-    # Sort by last updated, newest first
-    chat_files.sort(key=lambda x: x.last_updated, reverse=True)
-    return chat_files
+async def get_chats(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    before: Optional[str] = None,
+    storage: CachedStorage = Depends(deps.get_storage),
+):
+    """
+    Return a list of chat sessions, most recently updated first.
+    Pass the id of the last chat in a page as `before` to get the next page.
+    """
+    # Shared storage has no versions.
+    if (version := storage.list_version()) is not None:
+        etag = make_etag(version)
+        if cached := not_modified(request, etag):
+            return cached
+        response.headers["ETag"] = etag
+    # Listing writes dirty chats first.
+    return await asyncio.to_thread(storage.list_chats, limit=limit, before=before)
+
+
+@app.get("/events")
+async def get_multiplexed_events(
+    chat_id: list[str] = Query([]),
+    overflow: Optional[OverflowPolicy] = None,
+    window_ms: Optional[int] = Query(None, ge=0),
+    window_size: Optional[int] = Query(None, ge=1),
+    last_event_id: Optional[str] = Header(None),
+    pubsub: PubSub = Depends(deps.get_pubsub),
+):
+    """
+    Stream events of several chats over one SSE connection.
+    Pass `chat_id` once for each chat, or `*` for all chats.
 
+    Each event has the `chat_id` it belongs to. Events for all chats, such as a resync after overflow, have `*`.
+    The first event is `{"type": "stream", "stream_id": ...}`.
+    Use the stream id with `POST /events/{stream_id}` to add or remove chats without reconnecting.
+    Other arguments are the same as for `/{chat_id}/events`.
+    """
+    window = None if window_ms is None else window_ms / 1000
 
-@app.get("/{chat_id}/state", response_model=ChatState)
-async def get_chat_state_endpoint(state: ChatState = Depends(deps.get_chat_state)):
-    """Return the state of a chat session."""
-    return state
+    async def generate_events():
+        async with pubsub.subscribe_many(
+            chat_id, overflow=overflow, window=window, window_size=window_size, last_event_id=last_event_id
+        ) as subscription:
+            yield b"data: " + codec.dumps({"type": "stream", "stream_id": subscription.id}) + b"\r\n\r\n"
+            async for event in subscription:
+                yield event.tagged_frame
+
+    return EventSourceResponse(generate_events())
+
+
+@app.post("/events/{stream_id}")
+async def update_event_stream(
+    stream_id: str,
+    update: models.UpdateEventStreamRequest,
+    pubsub: PubSub = Depends(deps.get_pubsub),
+):
+    """
+    Add chats to or remove chats from a stream opened with `GET /events`. Returns the chats of the stream.
+    With several workers, the request must be sent to the worker serving the stream.
+    """
+    subscription = pubsub.get_stream(stream_id)
+    if not subscription:
+        raise HTTPException(status_code=404, detail="Stream not found")
+    for chat_id in update.remove:
+        await pubsub.remove_topic(subscription, chat_id)
+    for chat_id in update.add:
+        await pubsub.add_topic(subscription, chat_id)
+    return sorted(subscription.topics)
+
+
+@app.get("/runs/{run_id}", response_model=models.Run)
+async def get_run(run_id: str, runs: RunScheduler = Depends(deps.get_runs)):
+    """
+    Return the status of a run. Runs are kept for a while after they finish.
+    With several workers, the request must be sent to the worker that started the run.
+    """
+    run = runs.get(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run
 
 
-@app.put("/{chat_id}/assistant")
-async def set_assistant(assistant: str = Body(...), state: ChatState = Depends(deps.get_chat_state)):
+@app.get("/{chat_id}/state", response_model=ChatState)
+async def get_chat_state_endpoint(
+    request: Request,
+    chat_id: str,
+    limit: Optional[int] = Query(None, ge=1),
+    before: Optional[str] = None,
+    since: Optional[str] = None,
+    state: ChatState = Depends(deps.get_chat_state),
+    storage: CachedStorage = Depends(deps.get_storage),
+):
+    """
+    Return the state of a chat session.
+
+    Args:
+        limit: Only return the last `limit` messages
+        before: Only return messages before the message with this id
+        since: Only return messages after the message with this id
+    """
+    headers = {}
+    # Chats that have not been saved yet have no version.
+    if (version := storage.version(chat_id)) is not None:
+        headers["ETag"] = make_etag(version)
+        if cached := not_modified(request, headers["ETag"]):
+            return cached
+
+    messages = state.messages
+    if before:
+        messages = messages[: _message_index(messages, before)]
+    if since:
+        messages = messages[_message_index(messages, since) + 1 :]
+    if limit:
+        messages = messages[-limit:]
+    if messages is not state.messages:
+        state = state.model_copy(update={"messages": messages})
+    # Encoding directly skips validating and converting the state again for response_model.
+    return Response(codec.encode_state(state), media_type="application/json", headers=headers)
+
+
+def _message_index(messages: list[Message], message_id: str) -> int:
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].id == message_id:
+            return i
+    raise HTTPException(status_code=404, detail=f"Message not found: {message_id}")
+
+
+@app.put("/{chat_id}/assistant", dependencies=[Depends(deps.lock_chat)])
+async def set_assistant(
+    assistant: str = Body(...),
+    state: ChatState = Depends(deps.get_chat_state),
+    storage: ChatStorage = Depends(deps.get_storage),
+):
     """Update the assistant for a chat session."""
     state.assistant = assistant
-    state.save_to_disk()
+    await asyncio.to_thread(storage.save, state)
 
 
 @app.post("/{chat_id}/message", response_model=list[Message])
 async def send_message(
+    chat_id: str,
+    request: Request,
+    response: Response,
     message: models.SendMessageRequest,
     background_tasks: BackgroundTasks,
+    stream: bool = False,
+    assistant: Assistant = Depends(deps.get_assistant),
+    pubsub: PubSub = Depends(deps.get_pubsub),
+    runs: RunScheduler = Depends(deps.get_runs),
+):
+    """
+    Handle a message from the client.
+    Returns the new messages when the assistant is done.
+    The id of the run is in the `X-Run-ID` header and in the events it publishes.
+
+    With `?stream=1` or `Accept: text/event-stream`, the events of this run are streamed as SSE while it runs,
+    followed by an `end_run` event with the new messages.
+
+    Responds with 429 and `Retry-After` if too many requests are waiting for the assistant's model.
+    The message is not added to the chat then.
+    """
+    run = runs.create(chat_id)
+    if not (stream or "text/event-stream" in request.headers.get("accept", "")):
+        response.headers["X-Run-ID"] = run.id
+        watcher = asyncio.create_task(_cancel_on_disconnect(request, run, runs))
+        try:
+            await _execute_in_lane(run, message, background_tasks, assistant)
+        finally:
+            watcher.cancel()
+        return run.messages
+
+    events = Subscription(pubsub.max_queue_size, "coalesce", window=pubsub.window, window_size=pubsub.window_size)
+    # The lane is taken by the task, so the response starts while the run waits for its turn and runs.
+    task = asyncio.create_task(
+        _execute_in_lane(run, message, background_tasks, assistant, on_event=lambda event: events.put(Event(event)))
+    )
+    task.add_done_callback(lambda _: events.close())
+
+    async def generate_events():
+        try:
+            async for event in events:
+                yield event.frame
+        finally:
+            # The response is cancelled when the client disconnects.
+            runs.cancel(run.id)
+        with contextlib.suppress(QueueFull):
+            await task
+        messages = [m.model_dump(mode="json") for m in run.messages]
+        end = {"type": "end_run", "run_id": run.id, "status": run.status, "error": run.error, "messages": messages}
+        yield Event(end).frame
+
+    return EventSourceResponse(generate_events(), headers={"X-Run-ID": run.id})
+
+
+async def _cancel_on_disconnect(request: Request, run: models.Run, runs: RunScheduler):
+    """Cancels the run when the client disconnects before it is done."""
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+    runs.cancel(run.id)
+
+
+@app.post("/{chat_id}/cancel", response_model=list[models.Run])
+async def cancel_runs(chat_id: str, runs: RunScheduler = Depends(deps.get_runs)):
+    """
+    Stop the assistant. Cancels the queued and running runs of the chat and returns them.
+    The reply in progress is kept and marked as truncated.
+    With several workers, only runs started by the worker that receives the request are cancelled.
+    """
+    return runs.cancel_chat(chat_id)
+
+
+@app.post("/{chat_id}/runs", response_model=models.Run, status_code=202)
+async def create_run(
+    chat_id: str,
+    message: models.SendMessageRequest,
     assistant: Assistant = Depends(deps.get_assistant),
-    chat: Chat = Depends(deps.get_chat),
+    runs: RunScheduler = Depends(deps.get_runs),
 ):
-    """Handle a message from the client."""
+    """
+    Handle a message from the client without waiting for the assistant.
+    Returns the queued run. Get its status and new messages with `GET /runs/{run_id}`
+    or follow its events on `/{chat_id}/events`.
+    """
+    run = runs.create(chat_id)
+    runs.start(_run_in_background(run, message, assistant))
+    return run
+
+
+async def _run_in_background(run: models.Run, message: models.SendMessageRequest, assistant: Assistant):
+    background_tasks = BackgroundTasks()
+    with contextlib.suppress(QueueFull):
+        await _execute_in_lane(run, message, background_tasks, assistant)
+    await background_tasks()
+
+
+async def _execute_in_lane(
+    run: models.Run,
+    message: models.SendMessageRequest,
+    background_tasks: BackgroundTasks,
+    assistant: Assistant,
+    on_event: Optional[Callable[[dict], None]] = None,
+):
+    """Runs the message in the chat's lane. `on_event` is called with each event the run publishes."""
+    async with deps.lanes.acquire(run.chat_id):
+        # Loaded in the lane, so the run sees the changes of earlier requests.
+        # A chat that is not cached is read from disk, so it is loaded in a thread.
+        chat = await asyncio.to_thread(deps.get_chat, run.chat_id)
+        if on_event:
+            publisher = chat.publisher
+
+            async def publish(event: dict):
+                on_event(event)
+                if publisher:
+                    await publisher(event)
+
+            chat.publisher = publish
+        await deps.runs.execute(run, run_message(message, background_tasks, assistant, chat, run))
+
+
+async def run_message(
+    message: models.SendMessageRequest,
+    background_tasks: BackgroundTasks,
+    assistant: Assistant,
+    chat: Chat,
+    run: models.Run,
+) -> Optional[list[Message]]:
+    chat.run_id = run.id
     try:
         if message.content.startswith("/"):
-            return await handle_command(chat, message.content)
+            run.messages = await handle_command(chat, message.content)
+            return run.messages
         user_message = Message(
             id=message.id,
             role="user",
             content=message.content,
         )
         assistant_messages = await Runner(assistant, chat).run(user_message)
-        background_tasks.add_task(tasks.update_title, chat)
+        background_tasks.add_task(tasks.update_title, chat, deps.storage, deps.lanes)
+        run.messages = assistant_messages
         return assistant_messages
+    except asyncio.CancelledError:
+        logger.info("Run cancelled")
+        await chat.truncate()
+        run.messages = chat.new_messages
+        raise
     except ClientDisconnect:
         logger.info("Client disconnected")
+        run.error = "Client disconnected"
     except Exception as e:
+        run.error = f"{e.__class__.__name__}: {e}"
+        if isinstance(e, QueueFull) and not chat.new_messages:
+            # Nothing was generated, so the client can send the message again after Retry-After.
+            chat.state.messages = [m for m in chat.state.messages if m.id != message.id]
+            raise
         logger.error(f"Error handling message: {e}")
         traceback.print_exc()
         reply = await chat.reply("assistant", name="Error")
@@ -132,7 +449,8 @@ async def send_message(
         # TODO add category "error"
         await reply.end()
     finally:
-        chat.state.save_to_disk()
+        chat._save()
+    return None
 
 
 async def handle_command(chat: Chat, content: str):
@@ -154,32 +472,44 @@ async def handle_command(chat: Chat, content: str):
             raise Exception("Unknown command")
 
 
-@app.delete("/{chat_id}/message/{message_id}")
-async def delete_message(
-    message_id: str,
-    state: ChatState = Depends(deps.get_chat_state),
-):
+@app.delete("/{chat_id}/message/{message_id}", dependencies=[Depends(deps.lock_chat)])
+async def delete_message(chat_id: str, message_id: str, storage: ChatStorage = Depends(deps.get_storage)):
     """Delete a message by its ID."""
-    state.messages = [msg for msg in state.messages if msg.id != message_id]
-    state.save_to_disk()
+    await asyncio.to_thread(storage.delete_message, chat_id, message_id)
 
 
-@app.delete("/{chat_id}")
-async def delete_chat(chat_id: str):
+@app.delete("/{chat_id}", dependencies=[Depends(deps.lock_chat)])
+async def delete_chat(chat_id: str, storage: ChatStorage = Depends(deps.get_storage)):
     """Delete a chat by its ID."""
-    file_path = ChatState.file_path(chat_id)
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    await asyncio.to_thread(storage.delete, chat_id)
 
 
 @app.get("/{chat_id}/events")
-async def get_events(chat_id: str, pubsub: PubSub = Depends(deps.get_pubsub)):
-    """Stream events to the client over SSE."""
+async def get_events(
+    chat_id: str,
+    overflow: Optional[OverflowPolicy] = None,
+    window_ms: Optional[int] = Query(None, ge=0),
+    window_size: Optional[int] = Query(None, ge=1),
+    last_event_id: Optional[str] = Header(None),
+    pubsub: PubSub = Depends(deps.get_pubsub),
+):
+    """
+    Stream events to the client over SSE.
+
+    Args:
+        overflow: What to do if the client cannot keep up with events. See `pubsub.OverflowPolicy`.
+        window_ms: Milliseconds to merge streamed chunks of a message before sending them. 0 sends every chunk.
+        window_size: Characters after which merged chunks are sent without waiting for the window to end.
+        last_event_id: Sent by reconnecting clients. Events missed since then are sent first,
+            or a resync event if they are no longer available.
+    """
+    window = None if window_ms is None else window_ms / 1000
 
     async def generate_events():
-        async with pubsub.subscribe(chat_id) as queue:
-            while True:
-                message = await queue.get()
-                yield ServerSentEvent(json.dumps(message))
+        async with pubsub.subscribe(
+            chat_id, overflow=overflow, window=window, window_size=window_size, last_event_id=last_event_id
+        ) as subscription:
+            async for event in subscription:
+                yield event.frame
 
     return EventSourceResponse(generate_events())
@@ -1,9 +1,11 @@
 import uuid
 from datetime import datetime
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseModel, Field
 
+from akson import Message
+
 
 class Assistant(BaseModel):
     name: str
@@ -13,9 +15,30 @@ class ChatSummary(BaseModel):
     id: str
     title: str
     last_updated: datetime
+    message_count: int = 0
+    assistant: Optional[str] = None
 
 
 class SendMessageRequest(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()).replace("-", ""))
     content: str
     assistant: Optional[str] = None
+
+
+class UpdateEventStreamRequest(BaseModel):
+    add: list[str] = []
+    remove: list[str] = []
+
+
+class Run(BaseModel):
+    """A run of an assistant on a chat, started by sending a message."""
+
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()).replace("-", ""))
+    chat_id: str
+    status: Literal["queued", "running", "succeeded", "failed", "cancelled"] = "queued"
+    created_at: datetime = Field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    messages: list[Message] = []
+    """Messages added by the assistant. Available when the run has finished."""
+    error: Optional[str] = None
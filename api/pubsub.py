@@ -1,14 +1,389 @@
 import asyncio
 import contextlib
+import itertools
 import uuid
+from collections import OrderedDict, deque
 from functools import partial
-from typing import Any, AsyncIterator, Callable, Coroutine, Dict
+from typing import Any, AsyncIterator, Callable, Coroutine, Dict, Literal, Optional
 
+import codec
+from broker import Broker
+from logger import logger
+
+# What to do when a subscriber does not keep up and its queue is full:
+# - drop_oldest: Drop the oldest pending message.
+# - coalesce: Merge pending chunks of the same message, then drop the oldest if still full.
+# - disconnect: Drop all pending messages, send a resync message and end the subscription.
+OverflowPolicy = Literal["drop_oldest", "coalesce", "disconnect"]
+
+# Subscribing to this topic receives the messages of all topics.
+WILDCARD = "*"
+
+
+class Event:
+    """
+    A published message, shared by all subscribers of the topic.
+
+    The message is encoded as an SSE frame the first time it is needed and the frame is reused,
+    so the message is encoded once no matter how many clients are streaming it.
+    """
+
+    __slots__ = ("data", "id", "topic", "_frame", "_tagged_frame")
+
+    def __init__(self, data: Any, id: Optional[str] = None, topic: Optional[str] = None):
+        self.data = data
+        self.id = id
+        """Assigned by PubSub when the event is published. Clients send it back to resume the stream."""
+        self.topic = topic
+        self._frame: Optional[bytes] = None
+        self._tagged_frame: Optional[bytes] = None
+
+    @property
+    def frame(self) -> bytes:
+        """The message as a server-sent event, ready to be written to the response."""
+        if self._frame is None:
+            self._frame = self._encode(self.data)
+        return self._frame
+
+    @property
+    def tagged_frame(self) -> bytes:
+        """
+        Like `frame`, but with the topic added to the message as `chat_id`, for streams of several topics.
+        Events that are not specific to a topic are tagged with the wildcard.
+        """
+        if self._tagged_frame is None:
+            data = self.data if isinstance(self.data, dict) else {"data": self.data}
+            self._tagged_frame = self._encode({"chat_id": self.topic or WILDCARD, **data})
+        return self._tagged_frame
+
+    def _encode(self, data: Any) -> bytes:
+        frame = b"data: " + codec.dumps(data) + b"\r\n\r\n"
+        if self.id:
+            frame = b"id: " + self.id.encode() + b"\r\n" + frame
+        return frame
+
+    def __eq__(self, other):
+        return isinstance(other, Event) and self.data == other.data
+
+    def __repr__(self):
+        return f"Event({self.data!r})"
+
+
+# Sent to subscribers that are disconnected due to overflow. They need to reload the state.
+RESYNC_EVENT = Event({"type": "resync"})
+
+
+def _is_chunk(event: Event) -> bool:
+    return isinstance(event.data, dict) and event.data.get("type") == "add_chunk"
+
+
+def merge_chunks(first: Event, second: Event) -> Optional[Event]:
+    """Returns a new event with both chunks if they are chunks of the same message field, otherwise None."""
+    a, b = first.data, second.data
+    if (
+        isinstance(a, dict)
+        and isinstance(b, dict)
+        and a.get("type") == b.get("type") == "add_chunk"
+        and a.get("id") == b.get("id")
+        and a.get("field") == b.get("field")
+        and a.get("index") == b.get("index")
+    ):
+        # Published events are shared between subscribers, so they must not be modified.
+        return Event({**a, "chunk": a["chunk"] + b["chunk"]}, id=second.id, topic=second.topic)
+    return None
+
+
+class ReplayBuffer:
+    """
+    Keeps the last `size` events of the `max_topics` most recently published topics,
+    so clients that reconnect can receive the events they missed.
+
+    Event ids are "<epoch>-<sequence number>". The sequence number comes from a single counter,
+    so it increases within each topic, and the epoch changes when the process restarts.
+    """
+
+    def __init__(self, size: int, max_topics: int):
+        self.size = size
+        self.max_topics = max_topics
+        self.epoch = uuid.uuid4().hex[:8]
+        self._counter = itertools.count(1)
+        self._topics: OrderedDict[str, deque[tuple[int, Event]]] = OrderedDict()
+        # Sequence number of the last event dropped from each topic's buffer
+        self._dropped_through: Dict[str, int] = {}
+        # Sequence number of the last event of topics that were removed entirely
+        self._forgotten_through = 0
+
+    def add(self, topic: str, event: Event) -> None:
+        """Assigns an id to the event and keeps it for replaying."""
+        seq = next(self._counter)
+        event.id = f"{self.epoch}-{seq}"
+        if not self.size:
+            return
+
+        events = self._topics.get(topic)
+        if events is None:
+            events = self._topics[topic] = deque()
+        else:
+            self._topics.move_to_end(topic)
+        if len(events) == self.size:
+            self._dropped_through[topic] = events.popleft()[0]
+        events.append((seq, event))
+
+        if len(self._topics) > self.max_topics:
+            old_topic, old_events = self._topics.popitem(last=False)
+            self._dropped_through.pop(old_topic, None)
+            self._forgotten_through = old_events[-1][0]
+
+    def since(self, topic: str, last_event_id: str) -> Optional[list[Event]]:
+        """Returns the events published to the topic after the given event, or None if some are no longer kept."""
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        last_seq = int(seq)
+
+        if topic == WILDCARD:
+            if last_seq < self._forgotten_through or any(last_seq < seq for seq in self._dropped_through.values()):
+                return None
+            missed = [(seq, event) for events in self._topics.values() for seq, event in events if seq > last_seq]
+            return [event for _, event in sorted(missed, key=lambda item: item[0])]
+
+        events = self._topics.get(topic)
+        if events is None:
+            return [] if last_seq >= self._forgotten_through else None
+        if last_seq < self._dropped_through.get(topic, 0):
+            return None
+        return [event for seq, event in events if seq > last_seq]
+
+
+class SubscriptionClosed(Exception):
+    pass
+
+
+class Subscription:
+    """
+    Bounded queue of events for a single subscriber.
+
+    Iterate over the subscription to receive events.
+    Iteration ends when the subscription is closed and all pending messages are consumed.
+
+    If `window` is set, consecutive chunks of the same message field are merged into one event.
+    A chunk is held for at most `window` seconds or until the merged chunk reaches `window_size` characters,
+    and is released as soon as any other event, such as the end of the message, arrives.
+    """
+
+    def __init__(self, max_size: int, overflow: OverflowPolicy, window: float = 0, window_size: int = 4096):
+        self.max_size = max_size
+        self.overflow = overflow
+        self.window = window
+        self.window_size = window_size
+        self.id = uuid.uuid4().hex
+        self.closed = False
+        self.topics: Dict[str, str] = {}
+        """Topics of a subscription made with `subscribe_many`, mapped to their subscription IDs."""
+        self.dropped = 0
+        """Number of messages dropped because the queue was full."""
+        self.coalesced = 0
+        """Number of chunks merged into other chunks because the queue was full."""
+        self._messages: deque[Event] = deque()
+        self._ready = asyncio.Event()
+
+    def put(self, message: Event) -> None:
+        if self.closed:
+            self.dropped += 1
+            return
+        if len(self._messages) >= self.max_size:
+            match self.overflow:
+                case "drop_oldest":
+                    self._drop_oldest()
+                case "coalesce":
+                    if self._merge(self._messages[-1], message):
+                        return
+                    self._coalesce()
+                    if len(self._messages) >= self.max_size:
+                        if _is_chunk(self._messages[0]):
+                            self._drop_oldest()
+                        else:
+                            # Without the event, the subscriber could not follow the chat, so it has to reload.
+                            self.dropped += len(self._messages)
+                            self._messages.clear()
+                            self._messages.append(RESYNC_EVENT)
+                case "disconnect":
+                    self.dropped += len(self._messages) + 1
+                    self._messages.clear()
+                    self._messages.append(RESYNC_EVENT)
+                    self.close()
+                    return
+        self._messages.append(message)
+        self._ready.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self._ready.set()
+
+    async def get(self) -> Event:
+        """Waits for the next event. Raises SubscriptionClosed if the subscription is closed."""
+        while not self._messages:
+            if self.closed:
+                raise SubscriptionClosed
+            self._ready.clear()
+            await self._ready.wait()
+        event = self._messages.popleft()
+        if self.window and _is_chunk(event):
+            event = await self._gather_chunks(event)
+        return event
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Event:
+        try:
+            return await self.get()
+        except SubscriptionClosed:
+            raise StopAsyncIteration
+
+    def _drop_oldest(self):
+        self._messages.popleft()
+        self.dropped += 1
+
+    async def _gather_chunks(self, event: Event) -> Event:
+        """Merges following chunks of the same message field into the event until the window is over."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.window
+        while len(event.data["chunk"]) < self.window_size:
+            if not self._messages:
+                if self.closed:
+                    break
+                self._ready.clear()
+                try:
+                    async with asyncio.timeout_at(deadline):
+                        await self._ready.wait()
+                except TimeoutError:
+                    break
+                continue
+            merged = merge_chunks(event, self._messages[0])
+            if not merged:
+                break
+            self._messages.popleft()
+            event = merged
+        return event
+
+    def _merge(self, last: Event, event: Event) -> bool:
+        """Merges the event into the last pending event if both are chunks of the same message field."""
+        merged = merge_chunks(last, event)
+        if merged:
+            self._messages[-1] = merged
+            self.coalesced += 1
+            return True
+        return False
+
+    def _coalesce(self):
+        """Merge consecutive chunks of the same message field into one."""
+        messages, self._messages = self._messages, deque()
+        for message in messages:
+            if not (self._messages and self._merge(self._messages[-1], message)):
+                self._messages.append(message)
+
+
+class InFlightMessages:
+    """
+    Tracks the messages of each topic that have begun but not ended,
+    so new subscribers can start with a snapshot of them instead of chunks of messages they have not seen begin.
+    """
+
+    # Replies that fail never end, so only the most recent messages of each topic are kept.
+    max_per_topic = 8
+
+    # Chunks of these fields replace the previous value instead of being appended to it.
+    replaced_fields = ("tool_call.id", "tool_call_id")
 
-class PubSub:
     def __init__(self):
-        self._subscribers: Dict[str, Dict[str, Callable[[Any], Coroutine]]] = {}
+        # Maps topics to message IDs to the begin_message and the chunks of each field and tool call index
+        self._topics: Dict[str, Dict[str, tuple[dict, Dict[tuple[str, Optional[int]], list[str]]]]] = {}
+
+    def update(self, topic: str, message: Any) -> None:
+        if not isinstance(message, dict):
+            return
+        match message.get("type"):
+            case "begin_message":
+                messages = self._topics.setdefault(topic, {})
+                messages[message["id"]] = (message, {})
+                if len(messages) > self.max_per_topic:
+                    del messages[next(iter(messages))]
+            case "add_chunk":
+                entry = self._topics.get(topic, {}).get(message["id"])
+                if entry:
+                    chunks = entry[1].setdefault((message["field"], message.get("index")), [])
+                    if message["field"] in self.replaced_fields:
+                        chunks.clear()
+                    chunks.append(message["chunk"])
+            case "end_message":
+                messages = self._topics.get(topic)
+                if messages:
+                    messages.pop(message["id"], None)
+                    if not messages:
+                        del self._topics[topic]
+            case "clear":
+                self._topics.pop(topic, None)
+
+    def snapshot(self, topic: str) -> list[Event]:
+        """Returns a begin_message and one chunk per field for each message in progress."""
+        topics = list(self._topics) if topic == WILDCARD else [topic]
+        events = []
+        for topic in topics:
+            for begin, fields in self._topics.get(topic, {}).values():
+                # Snapshot events have no id, so clients that resume later do so from the last live event.
+                events.append(Event(begin, topic=topic))
+                for (field, index), chunks in fields.items():
+                    chunks[:] = ["".join(chunks)]
+                    chunk = {"type": "add_chunk", "id": begin["id"], "field": field, "chunk": chunks[0]}
+                    if index is not None:
+                        chunk["index"] = index
+                    if "run_id" in begin:
+                        chunk["run_id"] = begin["run_id"]
+                    events.append(Event(chunk, topic=topic))
+        return events
+
+
+class PubSub:
+    def __init__(
+        self,
+        *,
+        max_queue_size: int = 1000,
+        overflow: OverflowPolicy = "coalesce",
+        window: float = 0,
+        window_size: int = 4096,
+        replay_size: int = 500,
+        replay_topics: int = 100,
+        broker: Optional[Broker] = None,
+    ):
+        # Subscribers of each topic. The tuples are replaced on every change, never modified,
+        # so publish can iterate over them without taking the lock.
+        self._queues: Dict[str, tuple[Subscription, ...]] = {}
+        self._callbacks: Dict[str, tuple[Callable[[Any], Coroutine], ...]] = {}
+        # Maps subscription IDs to topic and subscriber
+        self._subscribers: Dict[str, tuple[str, Subscription | Callable[[Any], Coroutine]]] = {}
         self._subscription_lock = asyncio.Lock()
+        self.max_queue_size = max_queue_size
+        self.overflow: OverflowPolicy = overflow
+        self.window = window
+        self.window_size = window_size
+        self._replay = ReplayBuffer(replay_size, replay_topics)
+        self._in_flight = InFlightMessages()
+        # Subscriptions made with subscribe_many, by stream ID
+        self._streams: Dict[str, Subscription] = {}
+        self.broker = broker
+        # Counters of subscriptions that have ended
+        self._dropped = 0
+        self._coalesced = 0
+
+    async def start(self) -> None:
+        """Starts receiving messages published by other processes, if a broker is set."""
+        if self.broker:
+            await self.broker.start(self._deliver, self.resync)
+
+    async def close(self) -> None:
+        if self.broker:
+            await self.broker.close()
 
     def get_publisher(self, topic: str) -> Callable[[Any], Coroutine]:
         return partial(self.publish, topic)
@@ -17,69 +392,181 @@ class PubSub:
         """
         Publish a message to a topic.
 
+        Messages are wrapped in a single Event, which is kept for replaying
+        and put into the subscription queues of the topic and the wildcard synchronously.
+        Callbacks added with `add_callback` are awaited with the message itself.
+        If a broker is set, the message is also sent to the other processes.
+
         Args:
             topic: The topic to publish to
             message: The message to publish
 
         Returns:
-            Number of subscribers that received the message
+            Number of subscribers in this process that received the message
         """
-        if topic not in self._subscribers:
-            return 0
-
-        subscriber_count = 0
-        pending_tasks = []
-
-        # Create tasks for all subscriber callbacks
-        for callback in self._subscribers[topic].values():
-            pending_tasks.append(asyncio.create_task(callback(message)))
-            subscriber_count += 1
-
-        # Await all notifications to complete if there are any
-        if pending_tasks:
-            await asyncio.gather(*pending_tasks, return_exceptions=True)
-
-        return subscriber_count
+        if self.broker:
+            self.broker.publish(topic, message)
+        return await self._deliver(topic, message)
+
+    async def _deliver(self, topic: str, message: Any) -> int:
+        """Delivers the message to the subscribers in this process."""
+        event = Event(message, topic=topic)
+        self._replay.add(topic, event)
+        self._in_flight.update(topic, message)
+        queues = self._queues.get(topic, ())
+        for subscription in queues:
+            subscription.put(event)
+        # A stream of both the topic and the wildcard gets the event once.
+        wildcard_queues = tuple(s for s in self._queues.get(WILDCARD, ()) if s not in queues)
+        for subscription in wildcard_queues:
+            subscription.put(event)
+
+        callbacks = self._callbacks.get(topic)
+        if not callbacks:
+            return len(queues) + len(wildcard_queues)
+
+        results = await asyncio.gather(*(callback(message) for callback in callbacks), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Error in subscriber callback of %s: %s", topic, result)
+
+        return len(queues) + len(wildcard_queues) + len(callbacks)
 
     @contextlib.asynccontextmanager
-    async def subscribe(self, topic: str) -> AsyncIterator[asyncio.Queue]:
+    async def subscribe(
+        self,
+        topic: str,
+        *,
+        max_queue_size: Optional[int] = None,
+        overflow: Optional[OverflowPolicy] = None,
+        window: Optional[float] = None,
+        window_size: Optional[int] = None,
+        last_event_id: Optional[str] = None,
+    ) -> AsyncIterator[Subscription]:
         """
         Subscribe to a topic using a context manager.
 
         Args:
             topic: The topic to subscribe to
+            max_queue_size: Maximum number of pending messages. Defaults to the value given to PubSub.
+            overflow: What to do when the queue is full. Defaults to the value given to PubSub.
+            window: Seconds to hold chunks of a message for merging. Defaults to the value given to PubSub.
+            window_size: Characters after which merged chunks are sent. Defaults to the value given to PubSub.
+            last_event_id: Id of the last event the subscriber received before reconnecting.
+                The events published after it are received first. If some of them are no longer kept,
+                a resync message is received instead.
+                Without it, the subscriber first receives a snapshot of the messages in progress.
 
         Returns:
-            An asyncio Queue that will receive messages
+            A Subscription that will receive events
 
         Example:
-            async with pubsub.subscribe("my-topic") as queue:
-                while True:
-                    message = await queue.get()
-                    # process message
+            async with pubsub.subscribe("my-topic") as subscription:
+                async for event in subscription:
+                    # process event.data
         """
-        queue = asyncio.Queue()
-        subscription_id = await self._subscribe(topic, queue)
+        subscription = Subscription(
+            max_queue_size or self.max_queue_size,
+            overflow or self.overflow,
+            window=self.window if window is None else window,
+            window_size=window_size or self.window_size,
+        )
+        subscription_id = await self._subscribe(topic, subscription, last_event_id)
 
         try:
-            yield queue
+            yield subscription
         finally:
             await self.unsubscribe(topic, subscription_id)
 
-    async def _subscribe(self, topic: str, queue: asyncio.Queue) -> str:
-        """
-        Internal method to handle subscription logic.
+    @contextlib.asynccontextmanager
+    async def subscribe_many(
+        self,
+        topics: list[str],
+        *,
+        max_queue_size: Optional[int] = None,
+        overflow: Optional[OverflowPolicy] = None,
+        window: Optional[float] = None,
+        window_size: Optional[int] = None,
+        last_event_id: Optional[str] = None,
+    ) -> AsyncIterator[Subscription]:
         """
+        Subscribe to several topics with a single queue. Arguments are the same as for `subscribe`.
 
-        async def callback(message: Any) -> None:
-            await queue.put(message)
+        Topics can be changed with `add_topic` and `remove_topic` while subscribed,
+        also from other requests by finding the subscription with `get_stream`.
+        Use `Event.topic` to tell which topic an event was published to.
 
+        Example:
+            async with pubsub.subscribe_many(["a", "b"]) as subscription:
+                async for event in subscription:
+                    # process event.topic and event.data
+        """
+        subscription = Subscription(
+            max_queue_size or self.max_queue_size,
+            overflow or self.overflow,
+            window=self.window if window is None else window,
+            window_size=window_size or self.window_size,
+        )
+        self._streams[subscription.id] = subscription
+        try:
+            for topic in topics:
+                await self.add_topic(subscription, topic, last_event_id)
+            yield subscription
+        finally:
+            del self._streams[subscription.id]
+            for topic in list(subscription.topics):
+                await self.remove_topic(subscription, topic)
+            self._end(subscription, ", ".join(topics) or "stream")
+
+    def get_stream(self, stream_id: str) -> Optional[Subscription]:
+        """Returns the subscription made with `subscribe_many` that has the given ID."""
+        return self._streams.get(stream_id)
+
+    async def add_topic(self, subscription: Subscription, topic: str, last_event_id: Optional[str] = None) -> None:
+        """Adds a topic to a subscription made with `subscribe_many`. See `subscribe` for `last_event_id`."""
+        if topic not in subscription.topics and not subscription.closed:
+            subscription.topics[topic] = await self._subscribe(topic, subscription, last_event_id)
+
+    async def remove_topic(self, subscription: Subscription, topic: str) -> None:
+        """Removes a topic from a subscription made with `subscribe_many`."""
+        subscription_id = subscription.topics.pop(topic, None)
+        if subscription_id:
+            async with self._subscription_lock:
+                self._remove(topic, subscription_id)
+
+    async def add_callback(self, topic: str, callback: Callable[[Any], Coroutine]) -> str:
+        """
+        Subscribe to a topic with a callback that is awaited for each message.
+        Returns the subscription ID to be passed to `unsubscribe`.
+        """
+        return await self._subscribe(topic, callback)
+
+    async def _subscribe(
+        self,
+        topic: str,
+        subscriber: Subscription | Callable[[Any], Coroutine],
+        last_event_id: Optional[str] = None,
+    ) -> str:
+        """
+        Internal method to handle subscription logic.
+        """
         subscription_id = str(uuid.uuid4())
 
         async with self._subscription_lock:
-            if topic not in self._subscribers:
-                self._subscribers[topic] = {}
-            self._subscribers[topic][subscription_id] = callback
+            self._subscribers[subscription_id] = (topic, subscriber)
+            if isinstance(subscriber, Subscription):
+                # No event can be published between replaying and adding the queue, because nothing is awaited.
+                missed = None if last_event_id is None else self._replay.since(topic, last_event_id)
+                if missed is None:
+                    if last_event_id is not None:
+                        subscriber.put(Event(RESYNC_EVENT.data, topic=topic))
+                    # The state does not include messages in progress, so they are sent separately.
+                    missed = self._in_flight.snapshot(topic)
+                for event in missed:
+                    subscriber.put(event)
+                self._queues[topic] = self._queues.get(topic, ()) + (subscriber,)
+            else:
+                self._callbacks[topic] = self._callbacks.get(topic, ()) + (subscriber,)
 
         return subscription_id
 
@@ -95,20 +582,56 @@ class PubSub:
             True if successfully unsubscribed, False otherwise
         """
         async with self._subscription_lock:
-            if topic not in self._subscribers:
+            subscriber = self._remove(topic, subscription_id)
+            if subscriber is None:
                 return False
-
-            if subscription_id not in self._subscribers[topic]:
-                return False
-
-            del self._subscribers[topic][subscription_id]
-
-            # Clean up empty topics
-            if not self._subscribers[topic]:
-                del self._subscribers[topic]
-
+            if isinstance(subscriber, Subscription):
+                self._end(subscriber, topic)
             return True
 
+    def _remove(self, topic: str, subscription_id: str) -> Optional[Subscription | Callable[[Any], Coroutine]]:
+        """Removes the subscriber from the topic and returns it. Must be called with the lock held."""
+        if self._subscribers.get(subscription_id, (None,))[0] != topic:
+            return None
+
+        _, subscriber = self._subscribers.pop(subscription_id)
+        subscribers = self._queues if isinstance(subscriber, Subscription) else self._callbacks
+        remaining = tuple(s for s in subscribers[topic] if s is not subscriber)
+
+        # Clean up empty topics
+        if remaining:
+            subscribers[topic] = remaining  # type: ignore
+        else:
+            del subscribers[topic]
+        return subscriber
+
+    def _end(self, subscription: Subscription, topic: str):
+        subscription.close()
+        self._dropped += subscription.dropped
+        self._coalesced += subscription.coalesced
+        if subscription.dropped:
+            logger.warning("Subscriber of %s dropped %d messages", topic, subscription.dropped)
+
+    def resync(self) -> None:
+        """Tells all subscribers to reload the state, because some messages might have been lost."""
+        subscriptions = {id(s): s for _, s in self._subscribers.values() if isinstance(s, Subscription)}
+        for subscription in subscriptions.values():
+            subscription.put(Event(RESYNC_EVENT.data))
+
+    def stats(self) -> dict[str, int]:
+        """Returns counters for monitoring."""
+        # Subscriptions made with subscribe_many are listed once for each topic.
+        subscriptions = list({id(s): s for _, s in self._subscribers.values() if isinstance(s, Subscription)}.values())
+        callbacks = sum(1 for _, s in self._subscribers.values() if not isinstance(s, Subscription))
+        return {
+            "topics": len(self._queues.keys() | self._callbacks.keys()),
+            "subscribers": len(subscriptions) + callbacks,
+            "streams": len(self._streams),
+            "pending_messages": sum(len(s._messages) for s in subscriptions),
+            "dropped_messages": self._dropped + sum(s.dropped for s in subscriptions),
+            "coalesced_messages": self._coalesced + sum(s.coalesced for s in subscriptions),
+        }
+
 
 # Example usage
 async def example_usage():
@@ -125,10 +648,9 @@ async def example_usage():
     # Subscriber task
     async def subscriber(name: str):
         try:
-            async with pubsub.subscribe("example-topic") as queue:
-                while True:
-                    message = await queue.get()
-                    print(f"Subscriber {name} received: {message}")
+            async with pubsub.subscribe("example-topic") as subscription:
+                async for event in subscription:
+                    print(f"Subscriber {name} received: {event.data}")
         except asyncio.CancelledError:
             print(f"Subscriber {name} was cancelled")
             raise
@@ -16,5 +16,6 @@ class Runner:
             session_id=self.chat.state.id,
         )
         self.chat.state.messages.append(user_message)
+        self.chat._save()
         await self.assistant.run(self.chat)
         return self.chat.new_messages
@@ -0,0 +1,127 @@
+import asyncio
+import inspect
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Optional, TypeVar
+
+import models
+
+T = TypeVar("T")
+
+
+class RunScheduler:
+    """
+    Runs assistants, at most `concurrency` at a time, and keeps the status of recent runs.
+
+    Runs that wait for a free slot are queued in the order they arrived.
+    Queued and running runs can be cancelled.
+    """
+
+    # Number of finished runs to keep for status requests
+    max_history = 1000
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._runs: OrderedDict[str, models.Run] = OrderedDict()
+        # Runs started with `start`, so they are not garbage collected while running
+        self._tasks: set[asyncio.Task] = set()
+        # Tasks of runs in `execute`, for cancelling them
+        self._executing: dict[str, asyncio.Task] = {}
+
+    def create(self, chat_id: str) -> models.Run:
+        run = models.Run(chat_id=chat_id)
+        self._runs[run.id] = run
+        if len(self._runs) > self.max_history:
+            # Forget the oldest finished runs. Unfinished runs are kept however many there are.
+            for old in list(self._runs.values()):
+                if len(self._runs) <= self.max_history:
+                    break
+                if old.finished_at:
+                    del self._runs[old.id]
+        return run
+
+    def get(self, run_id: str) -> Optional[models.Run]:
+        return self._runs.get(run_id)
+
+    async def execute(self, run: models.Run, work: Awaitable[T]) -> Optional[T]:
+        """
+        Waits for a free slot, then awaits the work and records its status in the run.
+        Returns None if the run is cancelled with `cancel`.
+        If the caller is cancelled, the run is cancelled too.
+        """
+        if run.status == "cancelled":
+            _close(work)
+            return None
+        task = asyncio.create_task(self._execute(run, work))
+        self._executing[run.id] = task
+        try:
+            try:
+                # Unlike awaiting the task, waiting lets it finish cleaning up when the caller is cancelled.
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                task.cancel()
+                await asyncio.wait([task])
+                raise
+        finally:
+            del self._executing[run.id]
+        if task.cancelled():
+            return None
+        return task.result()
+
+    async def _execute(self, run: models.Run, work: Awaitable[T]) -> T:
+        try:
+            async with self._semaphore:
+                run.status = "running"
+                run.started_at = datetime.now()
+                result = await work
+        except asyncio.CancelledError:
+            run.status = "cancelled"
+            raise
+        except BaseException as e:
+            run.status = "failed"
+            run.error = run.error or f"{e.__class__.__name__}: {e}"
+            raise
+        finally:
+            # The work never started if the run was cancelled while waiting for a slot.
+            _close(work)
+            run.finished_at = datetime.now()
+        if run.status == "running":
+            run.status = "failed" if run.error else "succeeded"
+        return result
+
+    def cancel(self, run_id: str) -> bool:
+        """Cancels a queued or running run. Returns False if there is no such run or it has finished."""
+        run = self._runs.get(run_id)
+        if not run or run.finished_at:
+            return False
+        if task := self._executing.get(run_id):
+            task.cancel()
+        else:
+            # Not in `execute` yet, e.g. waiting for the chat's lane. `execute` will not start it.
+            run.status = "cancelled"
+            run.finished_at = datetime.now()
+        return True
+
+    def cancel_chat(self, chat_id: str) -> list[models.Run]:
+        """Cancels the queued and running runs of a chat. Returns the cancelled runs."""
+        return [run for run in list(self._runs.values()) if run.chat_id == chat_id and self.cancel(run.id)]
+
+    def start(self, work: Awaitable) -> asyncio.Task:
+        """Runs the work in the background. Use for work that calls `execute`."""
+        task = asyncio.ensure_future(work)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def stats(self) -> dict[str, int]:
+        """Returns counters for monitoring."""
+        running = sum(1 for run in self._runs.values() if run.status == "running")
+        queued = sum(1 for run in self._runs.values() if run.status == "queued")
+        return {"concurrency": self.concurrency, "running": running, "queued": queued}
+
+
+def _close(work: Awaitable):
+    """Closes a coroutine that might not have been awaited, so Python does not warn about it."""
+    if inspect.iscoroutine(work):
+        work.close()
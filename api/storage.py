@@ -0,0 +1,318 @@
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Optional
+
+import codec
+import models
+from akson import ChatState, Message
+from framework.sqlite import Database
+from logger import logger
+
+
+class ChatStorage(ABC):
+    """Persists chat states."""
+
+    @abstractmethod
+    def load(self, chat_id: str) -> Optional[ChatState]:
+        """Returns the chat state or None if the chat does not exist."""
+        ...
+
+    @abstractmethod
+    def save(self, state: ChatState) -> None:
+        """Saves the changes made to the chat state since it was last loaded or saved."""
+        ...
+
+    @abstractmethod
+    def delete(self, chat_id: str) -> None:
+        """Deletes the chat. Does nothing if the chat does not exist."""
+        ...
+
+    @abstractmethod
+    def delete_message(self, chat_id: str, message_id: str) -> None:
+        """Deletes a message from the chat. Does nothing if the message does not exist."""
+        ...
+
+    @abstractmethod
+    def list_chats(self, limit: Optional[int] = None, before: Optional[str] = None) -> list[models.ChatSummary]:
+        """
+        Returns summaries of chats, most recently updated first.
+
+        Args:
+            limit: Maximum number of chats to return
+            before: Only return chats that come after the chat with this id in the list
+        """
+        ...
+
+
+# Summaries of chats, so listing chats does not need to load them.
+CHAT_INDEX_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS chats (
+        id TEXT PRIMARY KEY,
+        assistant TEXT,
+        title TEXT,
+        updated_at REAL NOT NULL,
+        message_count INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS chats_updated_at ON chats (updated_at);
+"""
+
+
+def _update_chat_index(conn: sqlite3.Connection, state: ChatState, updated_at: Optional[float] = None):
+    conn.execute(
+        """
+        INSERT INTO chats (id, assistant, title, updated_at, message_count) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            assistant = excluded.assistant,
+            title = excluded.title,
+            updated_at = excluded.updated_at,
+            message_count = excluded.message_count
+        """,
+        (state.id, state.assistant, state.title, updated_at or time.time(), len(state.messages)),
+    )
+
+
+def _list_chat_index(conn: sqlite3.Connection, limit: Optional[int], before: Optional[str]) -> list[models.ChatSummary]:
+    query = "SELECT id, title, updated_at, message_count, assistant FROM chats"
+    params: list = []
+    if before:
+        row = conn.execute("SELECT updated_at FROM chats WHERE id = ?", (before,)).fetchone()
+        if not row:
+            return []
+        query += " WHERE updated_at < ? OR (updated_at = ? AND id < ?)"
+        params += [row[0], row[0], before]
+    query += " ORDER BY updated_at DESC, id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return [
+        models.ChatSummary(
+            id=chat_id,
+            title=title or "Untitled Chat",
+            last_updated=datetime.fromtimestamp(updated_at),
+            message_count=message_count,
+            assistant=assistant,
+        )
+        for chat_id, title, updated_at, message_count, assistant in conn.execute(query, params)
+    ]
+
+
+class FileStorage(ChatStorage):
+    """
+    Stores each chat as a JSON snapshot plus an append-only log of changes made after the snapshot.
+
+    Saving appends only the changes since the last save to the log.
+    The log is compacted into a new snapshot once it holds more records than half of the chat's messages,
+    which keeps the amortized cost of a save constant, or when a change cannot be expressed as an append (e.g. deleting a message).
+    """
+
+    # Minimum number of log records before the log is compacted into a snapshot.
+    compact_threshold = 100
+
+    def __init__(self, directory: str = "chats"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # Number of records in the log file of each chat.
+        self._log_lengths: dict[str, int] = {}
+        index_path = os.path.join(directory, "index.db")
+        index_exists = os.path.exists(index_path)
+        self.index = Database(index_path, CHAT_INDEX_SCHEMA)
+        if not index_exists:
+            self.rebuild_index()
+
+    def file_path(self, chat_id: str):
+        return os.path.join(self.directory, f"{chat_id}.json")
+
+    def log_path(self, chat_id: str):
+        return os.path.join(self.directory, f"{chat_id}.jsonl")
+
+    def load(self, chat_id: str) -> Optional[ChatState]:
+        try:
+            with open(self.file_path(chat_id), "rb") as f:
+                state = codec.decode_state(f.read())
+        except FileNotFoundError:
+            return None
+        self._log_lengths[chat_id] = self._replay_log(state)
+        state._mark_persisted()
+        return state
+
+    def save(self, state: ChatState) -> None:
+        changes = state._get_changes()
+        if changes is None:
+            return self.compact(state)
+
+        messages, updates = changes
+        records = []
+        if updates:
+            records.append(codec.dumps({"op": "update", **updates}))
+        for message in messages:
+            records.append(b'{"op":"append","message":' + codec.encode_message(message) + b"}")
+        if not records:
+            return
+
+        log_length = self._log_lengths.get(state.id, 0) + len(records)
+        if log_length > max(self.compact_threshold, len(state.messages) // 2):
+            return self.compact(state)
+
+        with open(self.log_path(state.id), "ab") as f:
+            f.writelines(record + b"\n" for record in records)
+        self._log_lengths[state.id] = log_length
+        state._mark_persisted()
+        with self.index.connection() as conn:
+            _update_chat_index(conn, state)
+
+    def compact(self, state: ChatState) -> None:
+        """Writes a full snapshot of the state and discards the log."""
+        path = self.file_path(state.id)
+        with open(path + ".tmp", "wb") as f:
+            f.write(codec.encode_state(state))
+        os.replace(path + ".tmp", path)
+        if os.path.exists(self.log_path(state.id)):
+            os.remove(self.log_path(state.id))
+        self._log_lengths[state.id] = 0
+        state._mark_persisted()
+        with self.index.connection() as conn:
+            _update_chat_index(conn, state)
+
+    def delete(self, chat_id: str) -> None:
+        for path in (self.file_path(chat_id), self.log_path(chat_id)):
+            if os.path.exists(path):
+                os.remove(path)
+        self._log_lengths.pop(chat_id, None)
+        with self.index.connection() as conn:
+            conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+
+    def delete_message(self, chat_id: str, message_id: str) -> None:
+        state = self.load(chat_id)
+        if not state:
+            return
+        state.messages = [msg for msg in state.messages if msg.id != message_id]
+        self.save(state)
+
+    def list_chats(self, limit: Optional[int] = None, before: Optional[str] = None) -> list[models.ChatSummary]:
+        return _list_chat_index(self.index.connection(), limit, before)
+
+    def rebuild_index(self) -> None:
+        """Rebuilds the index by loading every chat in the directory."""
+        logger.info("Rebuilding chat index in %s", self.directory)
+        with self.index.connection() as conn:
+            conn.execute("DELETE FROM chats")
+            for filename in os.listdir(self.directory):
+                if filename.endswith(".json"):
+                    chat_id = filename[:-5]  # Remove .json extension
+                    try:
+                        state = self.load(chat_id)
+                        if not state:
+                            continue
+
+                        # Get the last modified time of the snapshot or the log, whichever is newer
+                        last_updated = os.path.getmtime(self.file_path(chat_id))
+                        if os.path.exists(self.log_path(chat_id)):
+                            last_updated = max(last_updated, os.path.getmtime(self.log_path(chat_id)))
+
+                        _update_chat_index(conn, state, last_updated)
+                    except Exception as e:
+                        logger.error(f"Error loading chat {chat_id}: {e}")
+
+    def _replay_log(self, state: ChatState) -> int:
+        """Applies the records in the log file to the state. Returns the number of records."""
+        try:
+            f = open(self.log_path(state.id), "rb")
+        except FileNotFoundError:
+            return 0
+
+        count = 0
+        # Messages might already be in the snapshot if the process crashed while compacting.
+        message_ids = {message.id for message in state.messages}
+        with f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Partially written record at the end of the log.
+                    break
+                record = codec.loads(line)
+                match record.pop("op"):
+                    case "append":
+                        message = Message.model_validate(record["message"])
+                        if message.id not in message_ids:
+                            state.messages.append(message)
+                            message_ids.add(message.id)
+                    case "update":
+                        for key, value in record.items():
+                            setattr(state, key, value)
+                count += 1
+        return count
+
+
+class SQLiteStorage(ChatStorage):
+    """Stores chats in a SQLite database in WAL mode, one row per message."""
+
+    SCHEMA = CHAT_INDEX_SCHEMA + """
+        CREATE TABLE IF NOT EXISTS messages (
+            seq INTEGER PRIMARY KEY,
+            chat_id TEXT NOT NULL,
+            id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            UNIQUE (chat_id, id)
+        );
+        CREATE INDEX IF NOT EXISTS messages_chat_id ON messages (chat_id, seq);
+    """
+
+    def __init__(self, path: str = os.path.join("chats", "chats.db")):
+        self.db = Database(path, self.SCHEMA)
+
+    def load(self, chat_id: str) -> Optional[ChatState]:
+        conn = self.db.connection()
+        row = conn.execute("SELECT assistant, title FROM chats WHERE id = ?", (chat_id,)).fetchone()
+        if not row:
+            return None
+        assistant, title = row
+        rows = conn.execute("SELECT data FROM messages WHERE chat_id = ? ORDER BY seq", (chat_id,))
+        messages = [codec.decode_message(data) for data, in rows]
+        state = ChatState(id=chat_id, assistant=assistant, title=title, messages=messages)
+        state._mark_persisted()
+        return state
+
+    def save(self, state: ChatState) -> None:
+        changes = state._get_changes()
+        with self.db.connection() as conn:
+            _update_chat_index(conn, state)
+            if changes is None:
+                conn.execute("DELETE FROM messages WHERE chat_id = ?", (state.id,))
+                messages = state.messages
+            else:
+                messages, _ = changes
+            conn.executemany(
+                "INSERT OR REPLACE INTO messages (chat_id, id, data) VALUES (?, ?, ?)",
+                [(state.id, message.id, codec.encode_message(message).decode()) for message in messages],
+            )
+        state._mark_persisted()
+
+    def delete(self, chat_id: str) -> None:
+        with self.db.connection() as conn:
+            conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+
+    def delete_message(self, chat_id: str, message_id: str) -> None:
+        with self.db.connection() as conn:
+            cursor = conn.execute("DELETE FROM messages WHERE chat_id = ? AND id = ?", (chat_id, message_id))
+            if cursor.rowcount:
+                conn.execute(
+                    "UPDATE chats SET updated_at = ?, message_count = message_count - 1 WHERE id = ?",
+                    (time.time(), chat_id),
+                )
+
+    def list_chats(self, limit: Optional[int] = None, before: Optional[str] = None) -> list[models.ChatSummary]:
+        return _list_chat_index(self.db.connection(), limit, before)
+
+
+def create_storage(name: str) -> ChatStorage:
+    """Creates a storage backend by name."""
+    match name:
+        case "file":
+            return FileStorage()
+        case "sqlite":
+            return SQLiteStorage()
+        case _:
+            raise ValueError(f"Unknown chat storage: {name}")
@@ -1,10 +1,17 @@
+import asyncio
+
 from pydantic import BaseModel
 
-from akson import Assistant, Chat, ChatState
-from framework import Agent
+from akson import Assistant, Chat
+from framework import Agent, MCPToolkit
+from framework.admission import QueueFull
+from lanes import ChatLanes
+from logger import logger
+from registry import Registry
+from storage import ChatStorage
 
 
-async def update_title(chat: Chat):
+async def update_title(chat: Chat, storage: ChatStorage, lanes: ChatLanes):
     if chat.state.title:
         return
 
@@ -16,18 +23,39 @@ async def update_title(chat: Chat):
         model="gpt-4.1-nano",
         system_prompt="Analyze the conversation and output a title for the conversation.",
         output_type=TitleResponse,
+        priority="background",
     )
 
     temp = Chat()
     temp.state.messages = chat.state.messages.copy()
 
-    await titler.run(temp)
+    try:
+        await titler.run(temp)
+    except QueueFull as e:
+        # The title is generated after the next message instead.
+        logger.info(f"Skipping title: {e}")
+        return
 
     output = temp.state.messages[-1].content
     instance = TitleResponse.model_validate_json(output)
 
-    # TODO Fix race condition. Lock?
-    state = ChatState.load_from_disk(chat.state.id)
-    state.title = instance.title
-    state.save_to_disk()
-    await chat._queue_message({"type": "update_title", "title": chat.state.title})
+    async with lanes.acquire(chat.state.id):
+        state = await asyncio.to_thread(storage.load, chat.state.id)
+        if not state:
+            return
+        state.title = instance.title
+        await asyncio.to_thread(storage.save, state)
+    await chat._queue_message({"type": "update_title", "title": state.title})
+
+
+async def warm_up_tools(registry: Registry):
+    """Lists the tools of MCP-backed assistants, so their servers are ready before the first message."""
+    toolkits = [
+        assistant.toolkit
+        for assistant in registry.assistants
+        if isinstance(assistant, Agent) and isinstance(assistant.toolkit, MCPToolkit)
+    ]
+    results = await asyncio.gather(*(toolkit.get_tools() for toolkit in toolkits), return_exceptions=True)
+    for toolkit, result in zip(toolkits, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not list tools of {toolkit.server_params.command}: {result}")
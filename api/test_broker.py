@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from broker import UnixSocketBroker, create_broker
+from pubsub import PubSub
+
+
+async def wait_for(condition, timeout: float = 5):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_unix_socket_broker(tmp_path):
+    path = str(tmp_path / "events.sock")
+    brokers = [UnixSocketBroker(path) for _ in range(3)]
+    pubsubs = [PubSub(broker=broker) for broker in brokers]
+    for pubsub in pubsubs:
+        await pubsub.start()
+    try:
+        hub = brokers[0]
+        await wait_for(lambda: hub.is_hub and len(hub._peers) == 2)
+
+        async with pubsubs[0].subscribe("topic") as first, pubsubs[2].subscribe("topic") as third:
+            # Published in one loop iteration, so they are sent as one batch.
+            for i in range(100):
+                await pubsubs[1].publish("topic", i)
+            assert [(await first.get()).data for _ in range(100)] == list(range(100))
+            assert [(await third.get()).data for _ in range(100)] == list(range(100))
+
+            await pubsubs[0].publish("topic", "from hub")
+            assert (await third.get()).data == "from hub"
+            assert (await first.get()).data == "from hub"
+            assert not first._messages
+
+        # Another process becomes the hub when the hub exits, and subscribers are told to resync.
+        await pubsubs[0].close()
+        async with pubsubs[2].subscribe("topic") as third:
+            await wait_for(lambda: any(broker.is_hub for broker in brokers[1:]))
+            await wait_for(lambda: bool(third._messages))
+            assert (await third.get()).data == {"type": "resync"}
+            await wait_for(lambda: brokers[1]._hub is not None or brokers[2]._hub is not None)
+            await pubsubs[1].publish("topic", "after")
+            assert (await third.get()).data == "after"
+    finally:
+        for pubsub in pubsubs:
+            await pubsub.close()
+
+
+def test_create_broker():
+    assert create_broker("") is None
+    assert isinstance(create_broker("unix:/tmp/events.sock"), UnixSocketBroker)
+    with pytest.raises(ValueError):
+        create_broker("kafka://localhost")
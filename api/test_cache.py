@@ -0,0 +1,112 @@
+import threading
+
+from akson import ChatState, Message
+from cache import CachedStorage
+from storage import FileStorage
+
+
+def test_load_returns_same_object(tmp_path):
+    storage = CachedStorage(FileStorage(str(tmp_path)))
+    storage.save(ChatState.create_new("chat", "ChatGPT"))
+    assert storage.load("chat") is storage.load("chat")
+
+
+def test_save_is_written_on_flush(tmp_path):
+    inner = FileStorage(str(tmp_path))
+    storage = CachedStorage(inner)
+    state = ChatState.create_new("chat", "ChatGPT")
+    state.messages.append(Message(role="user", content="hello"))
+    storage.save(state)
+    assert inner.load("chat") is None
+
+    storage.flush()
+    loaded = inner.load("chat")
+    assert loaded is not None
+    assert len(loaded.messages) == 1
+
+
+def test_eviction_flushes(tmp_path):
+    inner = FileStorage(str(tmp_path))
+    storage = CachedStorage(inner, max_size=1000)
+    for chat_id in ("a", "b"):
+        state = ChatState.create_new(chat_id, "ChatGPT")
+        state.messages.append(Message(role="user", content="x" * 600))
+        storage.save(state)
+    assert list(storage._states) == ["a", "b"]
+
+    storage.flush()
+    assert list(storage._states) == ["b"]
+    assert inner.load("a") is not None
+
+
+def test_delete_message(tmp_path):
+    storage = CachedStorage(FileStorage(str(tmp_path)))
+    state = ChatState.create_new("chat", "ChatGPT")
+    state.messages.extend([Message(role="user", content="a"), Message(role="user", content="b")])
+    storage.save(state)
+
+    storage.delete_message("chat", state.messages[0].id)
+    assert [message.content for message in state.messages] == ["b"]
+    loaded = storage.storage.load("chat")
+    assert loaded is not None
+    assert [message.content for message in loaded.messages] == ["b"]
+
+
+class SlowStorage(FileStorage):
+    """Blocks saves until `proceed` is set."""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.saving = threading.Event()
+        self.proceed = threading.Event()
+
+    def save(self, state: ChatState) -> None:
+        self.saving.set()
+        assert self.proceed.wait(timeout=5)
+        super().save(state)
+
+
+def test_flush_does_not_block_cache(tmp_path):
+    inner = SlowStorage(str(tmp_path))
+    storage = CachedStorage(inner)
+    state = ChatState.create_new("chat", "ChatGPT")
+    storage.save(state)
+
+    flusher = threading.Thread(target=storage.flush)
+    flusher.start()
+    try:
+        assert inner.saving.wait(timeout=5)
+        # The state is changed and saved again while the first write is in progress.
+        assert storage.load("chat") is state
+        state.messages.append(Message(role="user", content="hello"))
+        storage.save(state)
+    finally:
+        inner.proceed.set()
+        flusher.join()
+
+    loaded = inner.load("chat")
+    assert loaded is not None
+    assert loaded.messages == []
+
+    storage.flush()
+    loaded = inner.load("chat")
+    assert loaded is not None
+    assert len(loaded.messages) == 1
+
+
+def test_shared_storage_is_not_cached(tmp_path):
+    # Two workers using the same storage
+    first = CachedStorage(FileStorage(str(tmp_path)), shared=True)
+    second = CachedStorage(FileStorage(str(tmp_path)), shared=True)
+    first.save(ChatState.create_new("chat", "ChatGPT"))
+
+    state = second.load("chat")
+    assert state is not None
+    state.messages.append(Message(role="user", content="hello"))
+    second.save(state)
+
+    loaded = first.load("chat")
+    assert loaded is not None
+    assert len(loaded.messages) == 1
+    assert first.version("chat") is None
+    assert first.list_version() is None
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from akson import ChatState, Message
+from cache import CachedStorage
+from lanes import ChatLanes
+from storage import SQLiteStorage
+
+
+@pytest.mark.asyncio
+async def test_same_chat_is_serialized():
+    lanes = ChatLanes()
+    events = []
+
+    async def work(chat_id: str, name: str):
+        async with lanes.acquire(chat_id):
+            events.append(f"start {name}")
+            await asyncio.sleep(0.01)
+            events.append(f"end {name}")
+
+    await asyncio.gather(work("chat", "a"), work("chat", "b"))
+    assert events == ["start a", "end a", "start b", "end b"]
+    assert lanes.pending("chat") == 0
+
+
+@pytest.mark.asyncio
+async def test_different_chats_run_concurrently():
+    lanes = ChatLanes()
+    events = []
+
+    async def work(chat_id: str):
+        async with lanes.acquire(chat_id):
+            events.append(f"start {chat_id}")
+            await asyncio.sleep(0.01)
+            events.append(f"end {chat_id}")
+
+    await asyncio.gather(work("a"), work("b"))
+    assert events[:2] == ["start a", "start b"]
+
+
+@pytest.mark.asyncio
+async def test_workers_are_serialized(tmp_path):
+    # Two workers sharing a storage, each with its own lanes
+    workers = [
+        (
+            ChatLanes(lock_dir=str(tmp_path / "locks")),
+            CachedStorage(SQLiteStorage(str(tmp_path / "chats.db")), shared=True),
+        )
+        for _ in range(2)
+    ]
+    workers[0][1].save(ChatState.create_new("chat", "ChatGPT"))
+    events = []
+
+    async def work(worker: int):
+        lanes, storage = workers[worker]
+        async with lanes.acquire("chat"):
+            events.append(f"start {worker}")
+            state = storage.load("chat")
+            assert state is not None
+            await asyncio.sleep(0.1)
+            state.messages.append(Message(role="user", content=str(worker)))
+            storage.save(state)
+            events.append(f"end {worker}")
+
+    await asyncio.gather(work(0), work(1))
+    assert events in (["start 0", "end 0", "start 1", "end 1"], ["start 1", "end 1", "start 0", "end 0"])
+    state = workers[0][1].load("chat")
+    assert state is not None
+    assert sorted(message.content for message in state.messages) == ["0", "1"]
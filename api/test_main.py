@@ -0,0 +1,318 @@
+import asyncio
+import json
+import os
+from typing import Optional
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi.testclient import TestClient
+from sse_starlette import sse
+
+# Assistants are loaded when the app is imported. Their keys are not used by these tests.
+for key in ("OPENAI_API_KEY", "EXA_API_KEY", "PERPLEXITY_API_KEY", "PUTIO_TOKEN", "JACKETT_API_KEY", "JACKETT_DOMAIN"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("DEFAULT_MODEL", "gpt-4.1")
+
+import litellm  # noqa: E402
+
+import deps  # noqa: E402
+import main  # noqa: E402
+import tasks  # noqa: E402
+from akson import Assistant, Chat, ChatState, Message  # noqa: E402
+from cache import CachedStorage  # noqa: E402
+from framework import Agent  # noqa: E402
+from framework import agent as agent_module  # noqa: E402
+from storage import FileStorage  # noqa: E402
+
+
+class Recorder:
+    """Wraps the app to record the chunks of response bodies as they are sent."""
+
+    def __init__(self, app):
+        self.app = app
+        self.chunks: list[bytes] = []
+
+    async def __call__(self, scope, receive, send):
+        async def record(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                self.chunks.append(message["body"])
+            await send(message)
+
+        await self.app(scope, receive, record)
+
+
+class Waiter(Assistant):
+    """Replies with one chunk, then waits until the app has sent a chunk of the response before ending."""
+
+    name = "Waiter"
+
+    def __init__(self, recorder: Recorder):
+        self.recorder = recorder
+        self.streamed_before_end = False
+
+    async def run(self, chat: Chat) -> None:
+        reply = await chat.reply("assistant", name=self.name)
+        await reply.add_chunk("Hello")
+        try:
+            async with asyncio.timeout(5):
+                while not self.recorder.chunks:
+                    await asyncio.sleep(0.01)
+            self.streamed_before_end = True
+        except TimeoutError:
+            pass
+        await reply.end()
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch) -> CachedStorage:
+    storage = CachedStorage(FileStorage(str(tmp_path)))
+    monkeypatch.setattr(deps, "storage", storage)
+    return storage
+
+
+@pytest.fixture
+def client(storage) -> TestClient:
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def recorder(storage, monkeypatch):
+    async def update_title(*args):
+        pass
+
+    # sse-starlette 2 keeps an event bound to the loop of the first response.
+    monkeypatch.setattr(sse.AppStatus, "should_exit_event", None, raising=False)
+    monkeypatch.setattr(tasks, "update_title", update_title)
+    return Recorder(main.app)
+
+
+def test_stream_starts_before_run_ends(recorder, monkeypatch):
+    assistant = Waiter(recorder)
+    monkeypatch.setitem(deps.registry._assistants, "waiter", assistant)
+
+    client = TestClient(recorder)
+    response = client.post("/chat/message?stream=1", json={"id": "m1", "content": "Hi", "assistant": "Waiter"})
+    assert response.status_code == 200
+    assert assistant.streamed_before_end
+
+    events = [json.loads(line[len("data: ") :]) for line in response.text.splitlines() if line.startswith("data: ")]
+    assert events[-1]["type"] == "end_run"
+    assert events[-1]["status"] == "succeeded"
+    assert [message["content"] for message in events[-1]["messages"]] == ["Hello"]
+
+
+class ProviderStream:
+    """Stands in for a stream of the OpenAI client. Sends the first chunk, then waits until it is closed."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+        self._iterator = self._iterate()
+
+    def __aiter__(self):
+        return self._iterator
+
+    async def _iterate(self):
+        yield await self.chunks.__anext__()
+        await asyncio.sleep(10)
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_disconnect_closes_completion_stream(recorder, monkeypatch):
+    streams: list[ProviderStream] = []
+
+    async def acompletion(**kwargs):
+        response = await litellm.acompletion(**kwargs, mock_response="Hello world")
+        stream = ProviderStream(getattr(response, "completion_stream"))
+        setattr(response, "completion_stream", stream)
+        streams.append(stream)
+        return response
+
+    monkeypatch.setattr(agent_module, "acompletion", acompletion)
+    monkeypatch.setitem(deps.registry._assistants, "slow", Agent(name="Slow", system_prompt="Reply slowly."))
+
+    body = json.dumps({"content": "Hi", "assistant": "Slow"}).encode()
+    first_chunk = asyncio.Event()
+    requested = False
+    headers = {}
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # The client disconnects after the first chunk of the reply.
+        await first_chunk.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            headers.update((key.decode(), value.decode()) for key, value in message["headers"])
+        elif b"add_chunk" in message.get("body", b""):
+            first_chunk.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/chat/message",
+        "raw_path": b"/chat/message",
+        "query_string": b"stream=1",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+    async with asyncio.timeout(5):
+        await main.app(scope, receive, send)
+        run = deps.runs.get(headers["x-run-id"])
+        assert run
+        while not run.finished_at:
+            await asyncio.sleep(0.01)
+
+    assert run.status == "cancelled"
+    assert [stream.closed for stream in streams] == [True]
+    state = deps.storage.load("chat")
+    assert state
+    assert state.messages[-1].role == "assistant"
+    assert state.messages[-1].truncated
+
+
+def save_chat(storage: CachedStorage, *contents: str) -> list[str]:
+    """Saves a chat with a user message of each content and returns the message ids."""
+    state = ChatState.create_new("chat", "ChatGPT")
+    state.messages = [Message(role="user", content=content) for content in contents]
+    storage.save(state)
+    return [message.id for message in state.messages]
+
+
+def get_contents(client: TestClient, **params) -> list[str]:
+    response = client.get("/chat/state", params=params)
+    assert response.status_code == 200
+    return [message["content"] for message in response.json()["messages"]]
+
+
+def test_state_pages(storage, client):
+    ids = save_chat(storage, "a", "b", "c", "d")
+    assert get_contents(client) == ["a", "b", "c", "d"]
+    assert get_contents(client, limit=2) == ["c", "d"]
+    assert get_contents(client, limit=2, before=ids[2]) == ["a", "b"]
+    assert get_contents(client, before=ids[0]) == []
+
+
+def test_state_since(storage, client):
+    ids = save_chat(storage, "a", "b", "c")
+    assert get_contents(client, since=ids[0]) == ["b", "c"]
+    assert get_contents(client, since=ids[2]) == []
+
+    response = client.get("/chat/state", params={"since": "unknown"})
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("path", ["/assistants", "/chats", "/chat/state"])
+def test_not_modified(storage, client, path):
+    save_chat(storage, "a")
+    response = client.get(path)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = client.get(path, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert not response.content
+
+    response = client.get(path, headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("path", ["/chats", "/chat/state"])
+def test_etag_changes_after_write(storage, client, path):
+    save_chat(storage, "a")
+    etag = client.get(path).headers["ETag"]
+
+    state = storage.load("chat")
+    assert state is not None
+    state.messages.append(Message(role="user", content="b"))
+    storage.save(state)
+
+    response = client.get(path, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+class Gate(Assistant):
+    """Replies after `opened` is set, or fails if `error` is set."""
+
+    name = "Gate"
+
+    def __init__(self, error: Optional[Exception] = None):
+        self.opened = asyncio.Event()
+        self.error = error
+
+    async def run(self, chat: Chat) -> None:
+        await self.opened.wait()
+        if self.error:
+            raise self.error
+        reply = await chat.reply("assistant", name=self.name)
+        await reply.add_chunk("Done")
+        await reply.end()
+
+
+@pytest_asyncio.fixture
+async def async_client(storage, monkeypatch):
+    async def update_title(*args):
+        pass
+
+    monkeypatch.setattr(tasks, "update_title", update_title)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+        yield client
+
+
+async def wait_for_run(client: httpx.AsyncClient, run_id: str) -> dict:
+    async with asyncio.timeout(5):
+        while True:
+            response = await client.get(f"/runs/{run_id}")
+            assert response.status_code == 200
+            if response.json()["finished_at"]:
+                return response.json()
+            await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_run_succeeds(async_client, monkeypatch):
+    assistant = Gate()
+    monkeypatch.setitem(deps.registry._assistants, "gate", assistant)
+
+    response = await async_client.post("/chat/runs", json={"content": "Hi", "assistant": "Gate"})
+    assert response.status_code == 202
+    assert response.json()["status"] == "queued"
+
+    assistant.opened.set()
+    run = await wait_for_run(async_client, response.json()["id"])
+    assert run["status"] == "succeeded"
+    assert [message["content"] for message in run["messages"]] == ["Done"]
+
+
+@pytest.mark.asyncio
+async def test_run_fails(async_client, monkeypatch):
+    assistant = Gate(error=RuntimeError("boom"))
+    assistant.opened.set()
+    monkeypatch.setitem(deps.registry._assistants, "gate", assistant)
+
+    response = await async_client.post("/chat/runs", json={"content": "Hi", "assistant": "Gate"})
+    assert response.status_code == 202
+    run = await wait_for_run(async_client, response.json()["id"])
+    assert run["status"] == "failed"
+    assert run["error"] == "RuntimeError: boom"
+
+
+@pytest.mark.asyncio
+async def test_unknown_run(async_client):
+    response = await async_client.get("/runs/unknown")
+    assert response.status_code == 404
@@ -0,0 +1,235 @@
+import pytest
+
+from pubsub import RESYNC_EVENT, Event, PubSub, ReplayBuffer, Subscription
+
+
+def chunk(chunk: str, id: str = "m1", field: str = "content") -> Event:
+    return Event({"type": "add_chunk", "id": id, "field": field, "chunk": chunk})
+
+
+@pytest.mark.asyncio
+async def test_publish_and_subscribe():
+    pubsub = PubSub()
+    async with pubsub.subscribe("topic") as subscription:
+        assert await pubsub.publish("topic", "hello") == 1
+        assert (await subscription.get()).data == "hello"
+    assert await pubsub.publish("topic", "hello") == 0
+
+
+@pytest.mark.asyncio
+async def test_callback():
+    pubsub = PubSub()
+    received = []
+
+    async def callback(message):
+        received.append(message)
+
+    subscription_id = await pubsub.add_callback("topic", callback)
+    async with pubsub.subscribe("topic") as subscription:
+        assert await pubsub.publish("topic", "hello") == 2
+        assert (await subscription.get()).data == "hello"
+    assert received == ["hello"]
+
+    assert await pubsub.unsubscribe("topic", subscription_id)
+    assert await pubsub.publish("topic", "hello") == 0
+
+
+@pytest.mark.asyncio
+async def test_overflow_coalesce_pending():
+    subscription = Subscription(max_size=3, overflow="coalesce")
+    for message in (chunk("a"), chunk("b"), Event("end"), chunk("c")):
+        subscription.put(message)
+    subscription.close()
+    assert [message async for message in subscription] == [chunk("ab"), Event("end"), chunk("c")]
+
+
+@pytest.mark.asyncio
+async def test_overflow_drop_oldest():
+    subscription = Subscription(max_size=2, overflow="drop_oldest")
+    for message in ("a", "b", "c"):
+        subscription.put(Event(message))
+    subscription.close()
+    assert [event.data async for event in subscription] == ["b", "c"]
+    assert subscription.dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_overflow_coalesce():
+    subscription = Subscription(max_size=2, overflow="coalesce")
+    for message in (chunk("a"), chunk("b"), chunk("c")):
+        subscription.put(message)
+    subscription.close()
+    assert [message async for message in subscription] == [chunk("a"), chunk("bc")]
+    assert subscription.coalesced == 1
+    assert subscription.dropped == 0
+
+
+@pytest.mark.asyncio
+async def test_overflow_coalesce_resyncs_instead_of_dropping_events():
+    subscription = Subscription(max_size=2, overflow="coalesce")
+    for message in (chunk("a"), Event("end"), Event("begin")):
+        subscription.put(message)
+    # The oldest pending event is a chunk, so it is dropped.
+    assert subscription.dropped == 1
+
+    subscription.put(chunk("b"))
+    subscription.close()
+    assert [event async for event in subscription] == [RESYNC_EVENT, chunk("b")]
+    assert subscription.dropped == 3
+
+
+@pytest.mark.asyncio
+async def test_overflow_disconnect():
+    subscription = Subscription(max_size=2, overflow="disconnect")
+    for message in ("a", "b", "c", "d"):
+        subscription.put(Event(message))
+    assert [event async for event in subscription] == [RESYNC_EVENT]
+    assert subscription.dropped == 4
+
+
+@pytest.mark.asyncio
+async def test_event_encoded_once():
+    pubsub = PubSub()
+    async with pubsub.subscribe("topic") as first, pubsub.subscribe("topic") as second:
+        await pubsub.publish("topic", {"type": "clear"})
+        event = await first.get()
+        assert await second.get() is event
+        assert event.id is not None
+        assert event.frame == b"id: " + event.id.encode() + b'\r\ndata: {"type":"clear"}\r\n\r\n'
+        assert event.frame is event.frame
+
+
+@pytest.mark.asyncio
+async def test_window_merges_chunks_until_end():
+    subscription = Subscription(max_size=100, overflow="coalesce", window=10)
+    for message in (chunk("a"), chunk("b"), chunk("c", field="reasoning"), Event("end")):
+        subscription.put(message)
+    assert await subscription.get() == chunk("ab")
+    assert await subscription.get() == chunk("c", field="reasoning")
+    assert await subscription.get() == Event("end")
+    assert subscription.coalesced == 0
+
+
+@pytest.mark.asyncio
+async def test_window_timeout():
+    subscription = Subscription(max_size=100, overflow="coalesce", window=0.01)
+    subscription.put(chunk("a"))
+    assert await subscription.get() == chunk("a")
+
+
+@pytest.mark.asyncio
+async def test_window_size():
+    subscription = Subscription(max_size=100, overflow="coalesce", window=10, window_size=2)
+    for message in (chunk("a"), chunk("b"), chunk("c")):
+        subscription.put(message)
+    assert await subscription.get() == chunk("ab")
+
+
+@pytest.mark.asyncio
+async def test_resume_with_last_event_id():
+    pubsub = PubSub()
+    async with pubsub.subscribe("topic") as subscription:
+        await pubsub.publish("topic", "a")
+        last_event_id = (await subscription.get()).id
+    await pubsub.publish("topic", "b")
+    await pubsub.publish("other", "x")
+    await pubsub.publish("topic", "c")
+
+    async with pubsub.subscribe("topic", last_event_id=last_event_id) as subscription:
+        await pubsub.publish("topic", "d")
+        subscription.close()
+        assert [event.data async for event in subscription] == ["b", "c", "d"]
+
+
+@pytest.mark.asyncio
+async def test_resume_after_events_are_dropped():
+    pubsub = PubSub(replay_size=2)
+    async with pubsub.subscribe("topic") as subscription:
+        await pubsub.publish("topic", "a")
+        last_event_id = (await subscription.get()).id
+    for message in ("b", "c", "d"):
+        await pubsub.publish("topic", message)
+
+    async with pubsub.subscribe("topic", last_event_id=last_event_id) as subscription:
+        assert await subscription.get() == RESYNC_EVENT
+    async with pubsub.subscribe("topic", last_event_id="unknown-1") as subscription:
+        assert await subscription.get() == RESYNC_EVENT
+
+
+def test_replay_buffer_forgets_old_topics():
+    buffer = ReplayBuffer(size=10, max_topics=1)
+    first = Event("a")
+    buffer.add("first", first)
+    buffer.add("second", Event("b"))
+    assert first.id is not None
+    assert buffer.since("first", first.id) == []
+    buffer.add("first", Event("c"))
+    assert buffer.since("second", first.id) is None
+
+
+@pytest.mark.asyncio
+async def test_snapshot_of_messages_in_progress():
+    pubsub = PubSub()
+    begin = {"type": "begin_message", "id": "m1", "role": "assistant", "name": "Echo"}
+    await pubsub.publish("topic", begin)
+    for message in (chunk("a"), chunk("b"), chunk("x", field="tool_call.name")):
+        await pubsub.publish("topic", message.data)
+
+    async with pubsub.subscribe("topic") as subscription:
+        await pubsub.publish("topic", chunk("c").data)
+        await pubsub.publish("topic", {"type": "end_message", "id": "m1"})
+        subscription.close()
+        assert [event.data async for event in subscription] == [
+            begin,
+            chunk("ab").data,
+            chunk("x", field="tool_call.name").data,
+            chunk("c").data,
+            {"type": "end_message", "id": "m1"},
+        ]
+
+    async with pubsub.subscribe("topic") as subscription:
+        subscription.close()
+        assert [event async for event in subscription] == []
+
+
+@pytest.mark.asyncio
+async def test_subscribe_many():
+    pubsub = PubSub()
+    async with pubsub.subscribe_many(["a", "b"]) as subscription:
+        assert pubsub.get_stream(subscription.id) is subscription
+        await pubsub.publish("a", "1")
+        await pubsub.publish("c", "2")
+        await pubsub.remove_topic(subscription, "a")
+        await pubsub.add_topic(subscription, "c")
+        await pubsub.publish("a", "3")
+        await pubsub.publish("b", "4")
+        await pubsub.publish("c", "5")
+        subscription.close()
+        assert [(event.topic, event.data) async for event in subscription] == [("a", "1"), ("b", "4"), ("c", "5")]
+    assert pubsub.get_stream(subscription.id) is None
+    assert pubsub.stats()["subscribers"] == 0
+
+
+@pytest.mark.asyncio
+async def test_wildcard_and_topic_deliver_once():
+    pubsub = PubSub()
+    async with pubsub.subscribe_many(["*", "a"]) as subscription:
+        assert await pubsub.publish("a", "1") == 1
+        assert await pubsub.publish("b", "2") == 1
+        subscription.close()
+        assert [(event.topic, event.data) async for event in subscription] == [("a", "1"), ("b", "2")]
+
+
+@pytest.mark.asyncio
+async def test_wildcard():
+    pubsub = PubSub()
+    async with pubsub.subscribe_many(["*"]) as subscription:
+        await pubsub.publish("a", {"type": "clear"})
+        await pubsub.publish("b", {"type": "clear"})
+        event = await subscription.get()
+        assert event.tagged_frame.endswith(b'data: {"chat_id":"a","type":"clear"}\r\n\r\n')
+        assert (await subscription.get()).topic == "b"
+        last_event_id = event.id
+
+    async with pubsub.subscribe_many(["*"], last_event_id=last_event_id) as subscription:
+        assert (await subscription.get()).topic == "b"
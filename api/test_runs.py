@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from runs import RunScheduler
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_limited():
+    runs = RunScheduler(concurrency=2)
+    release = asyncio.Event()
+
+    async def work(value: int) -> int:
+        await release.wait()
+        return value
+
+    all_runs = [runs.create("chat") for _ in range(3)]
+    tasks = [asyncio.create_task(runs.execute(run, work(i))) for i, run in enumerate(all_runs)]
+    await asyncio.sleep(0.01)
+    assert [run.status for run in all_runs] == ["running", "running", "queued"]
+    assert runs.stats() == {"concurrency": 2, "running": 2, "queued": 1}
+
+    release.set()
+    assert await asyncio.gather(*tasks) == [0, 1, 2]
+    assert [run.status for run in all_runs] == ["succeeded"] * 3
+    assert all(run.created_at <= run.started_at <= run.finished_at for run in all_runs)  # type: ignore
+
+
+@pytest.mark.asyncio
+async def test_failed_runs():
+    runs = RunScheduler(concurrency=1)
+
+    async def fail():
+        raise ValueError("boom")
+
+    run = runs.create("chat")
+    with pytest.raises(ValueError):
+        await runs.execute(run, fail())
+    assert run.status == "failed"
+    assert run.error == "ValueError: boom"
+
+    async def handled():
+        # Work that handles its own errors records them in the run.
+        run.error = "handled"
+
+    run = runs.create("chat")
+    await runs.execute(run, handled())
+    assert run.status == "failed"
+    assert runs.get(run.id) is run
+
+
+@pytest.mark.asyncio
+async def test_history_keeps_unfinished_runs():
+    runs = RunScheduler(concurrency=1)
+    runs.max_history = 2
+    unfinished = runs.create("chat")
+    finished = runs.create("chat")
+
+    async def work():
+        pass
+
+    await runs.execute(finished, work())
+    latest = runs.create("chat")
+    assert runs.get(unfinished.id) is unfinished
+    assert runs.get(finished.id) is None
+    assert runs.get(latest.id) is latest
+
+
+@pytest.mark.asyncio
+async def test_cancel():
+    runs = RunScheduler(concurrency=1)
+    started = asyncio.Event()
+
+    async def work():
+        started.set()
+        await asyncio.sleep(10)
+
+    running, queued, waiting = runs.create("chat"), runs.create("chat"), runs.create("chat")
+    tasks = [asyncio.create_task(runs.execute(run, work())) for run in (running, queued)]
+    await started.wait()
+
+    # A run that is not in `execute` yet does not start.
+    assert runs.cancel(waiting.id)
+    assert waiting.status == "cancelled"
+    assert await runs.execute(waiting, work()) is None
+
+    assert [run.id for run in runs.cancel_chat("chat")] == [running.id, queued.id]
+    assert await asyncio.gather(*tasks) == [None, None]
+    assert [run.status for run in (running, queued)] == ["cancelled", "cancelled"]
+    assert queued.started_at is None
+    assert not runs.cancel(running.id)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_cancels_run():
+    runs = RunScheduler(concurrency=1)
+    cleaned_up = asyncio.Event()
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        finally:
+            await asyncio.sleep(0.01)
+            cleaned_up.set()
+
+    run = runs.create("chat")
+    caller = asyncio.create_task(runs.execute(run, work()))
+    await asyncio.sleep(0.01)
+    caller.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await caller
+    # The run finished cleaning up before the caller returned.
+    assert cleaned_up.is_set()
+    assert run.status == "cancelled"
@@ -0,0 +1,167 @@
+import json
+
+import pytest
+
+from akson import ChatState, Message, ToolCall
+from storage import FileStorage, SQLiteStorage
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "file":
+        return FileStorage(str(tmp_path))
+    return SQLiteStorage(str(tmp_path / "chats.db"))
+
+
+def test_load_missing(storage):
+    assert storage.load("missing") is None
+
+
+def test_save_and_load(storage):
+    state = ChatState.create_new("chat", "ChatGPT")
+    storage.save(state)
+    for i in range(5):
+        state.messages.append(Message(role="user", content=str(i)))
+        storage.save(state)
+    state.title = "Title"
+    storage.save(state)
+
+    loaded = storage.load("chat")
+    assert loaded is not None
+    assert loaded.assistant == "ChatGPT"
+    assert loaded.title == "Title"
+    assert [message.content for message in loaded.messages] == ["0", "1", "2", "3", "4"]
+
+
+def test_save_after_clear(storage):
+    state = ChatState.create_new("chat", "ChatGPT")
+    state.messages.append(Message(role="user", content="hello"))
+    storage.save(state)
+    state.messages.clear()
+    storage.save(state)
+
+    loaded = storage.load("chat")
+    assert loaded is not None
+    assert loaded.messages == []
+
+
+def test_delete_message(storage):
+    state = ChatState.create_new("chat", "ChatGPT")
+    state.messages.extend([Message(role="user", content="a"), Message(role="user", content="b")])
+    storage.save(state)
+
+    storage.delete_message("chat", state.messages[0].id)
+
+    loaded = storage.load("chat")
+    assert loaded is not None
+    assert [message.content for message in loaded.messages] == ["b"]
+
+
+def test_delete_and_list(storage):
+    for chat_id in ("a", "b"):
+        storage.save(ChatState.create_new(chat_id, "ChatGPT"))
+    assert sorted(chat.id for chat in storage.list_chats()) == ["a", "b"]
+
+    storage.delete("a")
+    assert storage.load("a") is None
+    assert [chat.id for chat in storage.list_chats()] == ["b"]
+
+
+def test_file_storage_compaction(tmp_path):
+    storage = FileStorage(str(tmp_path))
+    storage.compact_threshold = 3
+    state = ChatState.create_new("chat", "ChatGPT")
+    storage.save(state)
+    for i in range(10):
+        state.messages.append(Message(role="user", content=str(i)))
+        storage.save(state)
+        assert storage._log_lengths["chat"] <= max(3, len(state.messages) // 2)
+
+    loaded = storage.load("chat")
+    assert loaded is not None
+    assert len(loaded.messages) == 10
+
+
+def test_changes_since_persisted():
+    state = ChatState.create_new("chat", "ChatGPT")
+    state.messages.append(Message(role="user", content="a"))
+    assert state._get_changes() is None
+
+    state._mark_persisted()
+    assert state._get_changes() == ([], {})
+    state.messages.append(Message(role="user", content="b"))
+    state.title = "Title"
+    assert state._get_changes() == (state.messages[1:], {"title": "Title"})
+
+    state.messages.pop(0)
+    assert state._get_changes() is None
+
+
+def test_file_storage_appends_only_changes(tmp_path):
+    storage = FileStorage(str(tmp_path))
+    state = ChatState.create_new("chat", "ChatGPT")
+    state.messages.append(Message(role="user", content="a"))
+    storage.save(state)
+    snapshot = (tmp_path / "chat.json").read_bytes()
+
+    state.messages.append(Message(role="user", content="b"))
+    state.title = "Title"
+    storage.save(state)
+    storage.save(state)
+
+    assert (tmp_path / "chat.json").read_bytes() == snapshot
+    records = [json.loads(line) for line in (tmp_path / "chat.jsonl").read_text().splitlines()]
+    assert [record["op"] for record in records] == ["update", "append"]
+    assert records[0]["title"] == "Title"
+    assert records[1]["message"]["content"] == "b"
+
+
+def test_list_chats_pagination(storage):
+    for chat_id in ("a", "b", "c"):
+        state = ChatState.create_new(chat_id, "ChatGPT")
+        state.messages.append(Message(role="user", content="hello"))
+        storage.save(state)
+
+    chats = storage.list_chats(limit=2)
+    assert [chat.id for chat in chats] == ["c", "b"]
+    assert chats[0].message_count == 1
+    assert chats[0].assistant == "ChatGPT"
+
+    chats = storage.list_chats(limit=2, before="b")
+    assert [chat.id for chat in chats] == ["a"]
+
+
+def test_file_storage_rebuilds_index(tmp_path):
+    storage = FileStorage(str(tmp_path))
+    state = ChatState.create_new("chat", "ChatGPT")
+    state.title = "Title"
+    storage.save(state)
+    (tmp_path / "index.db").unlink()
+
+    chats = FileStorage(str(tmp_path)).list_chats()
+    assert [(chat.id, chat.title) for chat in chats] == [("chat", "Title")]
+
+
+def test_file_storage_reads_indented_snapshot(tmp_path):
+    state = ChatState.create_new("chat", "ChatGPT")
+    state.messages.append(Message(role="user", content="hello"))
+    (tmp_path / "chat.json").write_text(state.model_dump_json(indent=2))
+
+    loaded = FileStorage(str(tmp_path)).load("chat")
+    assert loaded is not None
+    assert loaded.messages[0].content == "hello"
+
+
+def test_file_storage_reads_single_tool_call(tmp_path):
+    # Chats saved when a message could have only one tool call
+    message = {
+        "id": "m1",
+        "role": "assistant",
+        "content": "",
+        "tool_call": {"id": "c1", "name": "f", "arguments": "{}"},
+    }
+    (tmp_path / "chat.json").write_text(json.dumps({"id": "chat", "messages": [message], "assistant": "ChatGPT"}))
+
+    loaded = FileStorage(str(tmp_path)).load("chat")
+    assert loaded is not None
+    assert loaded.messages[0].tool_calls == [ToolCall(id="c1", name="f", arguments="{}")]
@@ -42,9 +42,13 @@ async def chat_loop(client: AksonClient, chat_id: str):
             continue
 
 
+# Number of previous messages to print when joining a chat
+HISTORY_LIMIT = 20
+
+
 async def chat(chat_id: str, client: AksonClient):
     # Get chat state
-    chat_state = await client.get_chat_state(chat_id)
+    chat_state = await client.get_chat_state(chat_id, limit=HISTORY_LIMIT)
 
     # Print previous messages if they exist
     if "messages" in chat_state:
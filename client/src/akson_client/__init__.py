@@ -1,6 +1,6 @@
 import asyncio
 import json
-from typing import Optional
+from typing import Any, AsyncIterator, Callable, Iterable, Optional
 
 import httpx
 
@@ -9,12 +9,39 @@ class AksonClient:
 
     def __init__(self, base_url: str):
         self.client = httpx.AsyncClient(base_url=base_url, timeout=None)
+        # Responses with an ETag, keyed by URL. Used for revalidating with If-None-Match.
+        self._cache: dict[str, tuple[str, Any]] = {}
 
-    async def get_assistants(self) -> list[str]:
-        response = await self.client.get(f"/assistants")
+    async def _get_json(self, url: str, params: Optional[dict] = None) -> Any:
+        """Sends a GET request, reusing the cached response if the server says it is not modified."""
+        key = str(self.client.build_request("GET", url, params=params).url)
+        headers = {}
+        if cached := self._cache.get(key):
+            headers["If-None-Match"] = cached[0]
+        response = await self.client.get(url, params=params, headers=headers)
+        if response.status_code == 304 and cached:
+            return cached[1]
         response.raise_for_status()
+        data = response.json()
+        if etag := response.headers.get("ETag"):
+            self._cache[key] = (etag, data)
+        else:
+            self._cache.pop(key, None)
+        return data
+
+    async def get_assistants(self) -> list[str]:
+        assistants = await self._get_json("/assistants")
         # TODO return list of objects
-        return [assistant["name"] for assistant in response.json()]
+        return [assistant["name"] for assistant in assistants]
+
+    async def get_chats(self, *, limit: Optional[int] = None, before: Optional[str] = None) -> list[dict]:
+        """Get chat summaries, most recently updated first."""
+        params = {}
+        if limit:
+            params["limit"] = limit
+        if before:
+            params["before"] = before
+        return await self._get_json("/chats", params=params)
 
     async def set_assistant(self, chat_id: str, assistant: str) -> None:
         response = await self.client.put(
@@ -24,10 +51,28 @@ class AksonClient:
         )
         response.raise_for_status()
 
-    async def get_chat_state(self, chat_id: str) -> dict:
-        response = await self.client.get(f"/{chat_id}/state")
+    async def get_chat_state(self, chat_id: str, *, limit: Optional[int] = None, before: Optional[str] = None) -> dict:
+        """
+        Get the state of a chat.
+        Pass `limit` to get only the last messages and `before` to page back from a message id.
+        """
+        params = {}
+        if limit:
+            params["limit"] = limit
+        if before:
+            params["before"] = before
+        return await self._get_json(f"/{chat_id}/state", params=params)
+
+    async def get_new_messages(self, chat_id: str, since: str) -> Optional[list[dict]]:
+        """
+        Get the messages added to a chat after the message with the given id.
+        Returns None if the message no longer exists and the full state must be fetched instead.
+        """
+        response = await self.client.get(f"/{chat_id}/state", params={"since": since})
+        if response.status_code == 404:
+            return None
         response.raise_for_status()
-        return response.json()
+        return response.json()["messages"]
 
     async def send_message(
         self, chat_id: str, content: str, *, assistant: Optional[str] = None, message_id: Optional[str] = None
@@ -41,11 +86,78 @@ class AksonClient:
         response.raise_for_status()
         return response.json()
 
+    async def stream_message(
+        self, chat_id: str, content: str, *, assistant: Optional[str] = None, message_id: Optional[str] = None
+    ) -> AsyncIterator[dict]:
+        """
+        Sends a message and yields the events of the run as they happen.
+        The last event is "end_run" with the new messages.
+        """
+        data = {"content": content}
+        if assistant:
+            data["assistant"] = assistant
+        if message_id:
+            data["id"] = message_id
+        async with self.client.stream("POST", f"/{chat_id}/message", params={"stream": 1}, json=data) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                prefix = "data: "
+                if line.startswith(prefix):
+                    yield json.loads(line[len(prefix) :])
+
+    async def create_run(
+        self, chat_id: str, content: str, *, assistant: Optional[str] = None, message_id: Optional[str] = None
+    ) -> dict:
+        """Sends a message without waiting for the assistant. Returns the run; poll it with `get_run`."""
+        data = {"content": content}
+        if assistant:
+            data["assistant"] = assistant
+        if message_id:
+            data["id"] = message_id
+        response = await self.client.post(f"/{chat_id}/runs", json=data)
+        response.raise_for_status()
+        return response.json()
+
+    async def get_run(self, run_id: str) -> dict:
+        """Get the status of a run and its new messages once it has finished."""
+        response = await self.client.get(f"/runs/{run_id}")
+        response.raise_for_status()
+        return response.json()
+
+    async def cancel(self, chat_id: str) -> list[dict]:
+        """Stop the assistant. Returns the cancelled runs."""
+        response = await self.client.post(f"/{chat_id}/cancel")
+        response.raise_for_status()
+        return response.json()
+
     async def stream_events(self, chat_id: str):
+        """
+        Yields events of the chat, reconnecting if the connection is lost.
+        Events missed while reconnecting are sent again by the server,
+        or a "resync" event is yielded if they are no longer available.
+        """
+        async for data in self._read_events(f"/{chat_id}/events"):
+            yield data
+
+    def stream_chats(self, chat_ids: Iterable[str]) -> "EventStream":
+        """
+        Returns a stream of events of several chats over one connection.
+        Pass "*" to receive events of all chats.
+        """
+        return EventStream(self, chat_ids)
+
+    async def _read_events(self, url: str, get_params: Callable[[], dict] = dict) -> AsyncIterator[dict]:
+        """Yields the data of server-sent events, reconnecting with Last-Event-ID if the connection is lost."""
+        last_event_id = None
         while True:
+            headers = {"Last-Event-ID": last_event_id} if last_event_id else {}
             try:
-                async with self.client.stream("GET", f"/{chat_id}/events", timeout=None) as response:
+                async with self.client.stream(
+                    "GET", url, params=get_params(), headers=headers, timeout=None
+                ) as response:
                     async for line in response.aiter_lines():
+                        if line.startswith("id: "):
+                            last_event_id = line[len("id: ") :]
                         prefix = "data: "
                         if line.startswith(prefix):
                             data = json.loads(line[len(prefix) :])
@@ -55,3 +167,49 @@ class AksonClient:
                 print(f"Connection lost in stream_events: {e}. Retrying in 1 second...")
                 await asyncio.sleep(1)
                 continue
+
+
+class EventStream:
+    """
+    Events of several chats over one connection. Each event has the `chat_id` it belongs to.
+    Chats can be added and removed while iterating.
+    """
+
+    def __init__(self, client: AksonClient, chat_ids: Iterable[str]):
+        self._client = client
+        self.chat_ids = set(chat_ids)
+        self.stream_id: Optional[str] = None
+        # Chats requested when the current connection was opened
+        self._requested: set[str] = set()
+
+    async def add(self, chat_id: str) -> None:
+        self.chat_ids.add(chat_id)
+        await self._update(add=[chat_id])
+
+    async def remove(self, chat_id: str) -> None:
+        self.chat_ids.discard(chat_id)
+        await self._update(remove=[chat_id])
+
+    async def __aiter__(self) -> AsyncIterator[dict]:
+        async for data in self._client._read_events("/events", self._get_params):
+            if data["type"] == "stream":
+                self.stream_id = data["stream_id"]
+                # Apply changes made while the connection was being opened.
+                await self._update(
+                    add=list(self.chat_ids - self._requested), remove=list(self._requested - self.chat_ids)
+                )
+                continue
+            yield data
+
+    def _get_params(self) -> dict:
+        self._requested = set(self.chat_ids)
+        return {"chat_id": list(self._requested)}
+
+    async def _update(self, *, add: Optional[list[str]] = None, remove: Optional[list[str]] = None) -> None:
+        if not self.stream_id or not (add or remove):
+            return
+        data = {"add": add or [], "remove": remove or []}
+        response = await self._client.client.post(f"/events/{self.stream_id}", json=data)
+        # The stream is gone if the connection was lost. The chats are requested again when reconnecting.
+        if response.status_code != 404:
+            response.raise_for_status()
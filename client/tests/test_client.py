@@ -0,0 +1,24 @@
+import asyncio
+
+import httpx
+
+from akson_client import AksonClient
+
+
+def test_not_modified_returns_cached_body():
+    requests: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"1"':
+            return httpx.Response(304, headers={"ETag": '"1"'})
+        return httpx.Response(200, json=[{"name": "ChatGPT"}], headers={"ETag": '"1"'})
+
+    async def get_twice():
+        client = AksonClient("http://akson")
+        client.client = httpx.AsyncClient(base_url="http://akson", transport=httpx.MockTransport(handler))
+        return await client.get_assistants(), await client.get_assistants()
+
+    assert asyncio.run(get_twice()) == (["ChatGPT"], ["ChatGPT"])
+    assert "If-None-Match" not in requests[0].headers
+    assert requests[1].headers["If-None-Match"] == '"1"'
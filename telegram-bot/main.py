@@ -1,4 +1,3 @@
-import asyncio
 import logging
 import os
 import subprocess
@@ -47,27 +46,27 @@ class Listener:
         # TODO load state and set both akson_chat_id and telegram_chat_id
         self.akson_chat_id = str(uuid.uuid4()).replace("-", "")
         self.telegram_chat_id: int | None = None
-        self._task: asyncio.Task | None = None
-        self._start()
+        # One stream for the bot. Switching chats changes the chat it follows without reconnecting.
+        self._events = akson.stream_chats([self.akson_chat_id])
+        self._task = self.app.create_task(self._listen_events())
 
     async def set_akson_chat_id(self, akson_chat_id: str):
         if akson_chat_id != self.akson_chat_id:
-            self.akson_chat_id = akson_chat_id
-            self._start()
+            old_chat_id, self.akson_chat_id = self.akson_chat_id, akson_chat_id
+            await self._events.add(akson_chat_id)
+            await self._events.remove(old_chat_id)
 
     async def set_telegram_chat_id(self, telegram_chat_id: int):
         self.telegram_chat_id = telegram_chat_id
 
-    def _start(self):
-        if self._task:
-            self._task.cancel()
-        self._task = self.app.create_task(self._listen_events(self.akson_chat_id))
-
-    async def _listen_events(self, akson_chat_id: str):
+    async def _listen_events(self):
         logger.info("Listening for events...")
         content = StringIO()
-        async for event in akson.stream_events(akson_chat_id):
+        async for event in self._events:
             logger.info(f"Event: {event}")
+            # Events of the previous chat might still arrive after switching.
+            if event["chat_id"] != self.akson_chat_id:
+                continue
             match event["type"]:
                 case "begin_message":
                     content.truncate(0)
@@ -24,7 +24,7 @@ function ChatApp({ chatId }) {
         role: msg.role,
         name: msg.name,
         content: msg.content,
-        toolCall: msg.tool_call,
+        toolCalls: msg.tool_calls,
         category: msg.category,
       })),
     );
@@ -35,7 +35,7 @@ function History({ messages, onDeleteMessage }) {
           key={msg.id}
           role={msg.role}
           content={msg.content}
-          toolCall={msg.toolCall}
+          toolCalls={msg.toolCalls}
           name={msg.name}
           category={msg.category}
           onDelete={onDeleteMessage}
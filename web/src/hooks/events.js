@@ -1,7 +1,10 @@
 import { useEffect } from "react";
+import { useQueryClient } from "@tanstack/react-query";
 import { API_BASE_URL } from "../constants";
 
 export function useEvents(chatId, setMessages, setSelectedAssistant) {
+  const queryClient = useQueryClient();
+
   useEffect(() => {
     const eventSource = new EventSource(`${API_BASE_URL}/${chatId}/events`, {
       withCredentials: true,
@@ -24,6 +27,9 @@ export function useEvents(chatId, setMessages, setSelectedAssistant) {
         ]);
       } else if (data.type === "clear") {
         setMessages([]);
+      } else if (data.type === "resync") {
+        // Server dropped events because we were too slow. Reload the state.
+        queryClient.invalidateQueries({ queryKey: [chatId, "state"] });
       } else if (data.type === "update_assistant") {
         setSelectedAssistant(data.assistant);
       } else if (data.type === "add_chunk") {
@@ -31,20 +37,20 @@ export function useEvents(chatId, setMessages, setSelectedAssistant) {
           const i = prev.length - 1;
           const message = structuredClone(prev[i]);
 
-          if (!message.toolCall && ["tool_call.name", "tool_call.arguments"].includes(data.field)) {
-            message.toolCall = { name: "", arguments: "" };
-          }
-
-          switch (data.field) {
-            case "content":
-              message.content += data.chunk;
-              break;
-            case "tool_call.name":
-              message.toolCall.name += data.chunk;
-              break;
-            case "tool_call.arguments":
-              message.toolCall.arguments += data.chunk;
-              break;
+          if (data.field.startsWith("tool_call.")) {
+            const index = data.index ?? 0;
+            message.toolCalls = message.toolCalls || [];
+            while (message.toolCalls.length <= index) {
+              message.toolCalls.push({ name: "", arguments: "" });
+            }
+            const toolCall = message.toolCalls[index];
+            if (data.field === "tool_call.name") {
+              toolCall.name += data.chunk;
+            } else if (data.field === "tool_call.arguments") {
+              toolCall.arguments += data.chunk;
+            }
+          } else if (data.field === "content") {
+            message.content += data.chunk;
           }
 
           return [...prev.slice(0, i), message];
@@ -55,5 +61,5 @@ export function useEvents(chatId, setMessages, setSelectedAssistant) {
     return () => {
       eventSource.close();
     };
-  }, [chatId, setMessages]);
+  }, [chatId, setMessages, queryClient]);
 }